@@ -0,0 +1,232 @@
+###
+# Attendance analytics over the whole RSVP history
+#
+# python analytics.py [name] [--flake-hours 24] [--rsvp-dir ./rsvps] [--top 10]
+#
+# The RSVP table (streamed in batches) and the ./rsvps/*.csv files import.py reads (with their journals)
+# are loaded into column arrays once; every metric after that is a handful of vectorized NumPy passes:
+#   attendance - share of games a member finished on 'yes', since their first reply
+#   flakes     - 'yes' changed to 'no', and how many of those came inside --flake-hours of the game
+#   latency    - time from the poll (the Invite log, else the game's first reply) to a member's first reply
+#   turnout    - players per game (members plus subs), averaged per season, with the recent trend
+# Needs numpy: pip install -e .[analytics]
+##
+import argparse
+import glob
+import os
+
+import numpy as np
+
+import app
+import config
+import journal
+import store
+
+FLAKE_HOURS = getattr(config, 'flake_hours', 24)  # a 'yes' to 'no' this close to the game is a late flake
+RSVP_DIR = './rsvps'
+REPLIES = {'no': 0, 'yes': 1, 'standby': 2}
+TREND_GAMES = 10  # games the turnout trend is fitted over
+
+
+class History(object):
+    # one row per reply, as parallel arrays
+    def __init__(self, names, games, replies, subs, timestamps):
+        # arrays from columns(); timestamp is -1 where unknown (CSV history)
+        self.names, self.member = np.unique(names, return_inverse=True)
+        self.game = games
+        self.reply = replies
+        self.sub = subs
+        self.timestamp = timestamps
+
+        # sorted by member, game, then time; a group is one member's replies for one game
+        order = np.lexsort((self.timestamp, self.game, self.member))
+        for column in ('member', 'game', 'reply', 'sub', 'timestamp'):
+            setattr(self, column, getattr(self, column)[order])
+        boundary = np.ones(len(self.member), dtype=bool)
+        boundary[1:] = (self.member[1:] != self.member[:-1]) | (self.game[1:] != self.game[:-1])
+        self.first = boundary  # first reply of each group
+        self.last = np.roll(boundary, -1)  # final reply of each group
+        if len(self.last):
+            self.last[-1] = True
+
+    def __len__(self):
+        return len(self.member)
+
+    def per_member(self, mask):
+        return np.bincount(self.member[mask], minlength=len(self.names))
+
+    def attendance(self):
+        # (games finished on 'yes', games since the member's first reply) per member
+        games = np.unique(self.game)
+        final = self.last
+        attended = self.per_member(final & (self.reply == REPLIES['yes']))
+        first_game = np.full(len(self.names), np.iinfo(np.int64).max)
+        np.minimum.at(first_game, self.member, self.game)
+        eligible = len(games) - np.searchsorted(games, first_game)
+        return attended, eligible
+
+    def flakes(self, hours=FLAKE_HOURS):
+        # (yes -> no changes, those inside `hours` of the game) per member
+        change = np.zeros(len(self), dtype=bool)
+        change[1:] = ~self.first[1:] & (self.reply[:-1] == REPLIES['yes']) & (self.reply[1:] == REPLIES['no'])
+        late = change & (self.timestamp >= self.game - int(hours * 3600))
+        return self.per_member(change), self.per_member(late)
+
+    def latency(self, invites):
+        # mean seconds from the poll to a member's first reply (NaN for members with no timed replies)
+        first = self.first & (self.timestamp >= 0)
+        games, timestamps = self.game[first], self.timestamp[first]
+        # poll time per game: the first logged invite, else the game's earliest reply
+        unique_games, index = np.unique(games, return_inverse=True)
+        polled = np.full(len(unique_games), np.iinfo(np.int64).max)
+        np.minimum.at(polled, index, timestamps)
+        # import.py stamps a game's replies with the time of the import: a game whose replies all share
+        #  one time and that has no logged invite has no reply times worth measuring
+        pairs = np.unique(np.stack([index, timestamps]), axis=1)
+        timed = np.bincount(pairs[0], minlength=len(unique_games)) > 1
+        if len(invites):
+            invite_games = np.array([i['game'] for i in invites], dtype=np.int64)
+            invite_times = np.array([i['timestamp'] for i in invites], dtype=np.int64)
+            sent = np.full(len(unique_games), np.iinfo(np.int64).max)
+            known = np.isin(invite_games, unique_games)
+            np.minimum.at(sent, np.searchsorted(unique_games, invite_games[known]), invite_times[known])
+            polled = np.where(sent < polled, sent, polled)
+            timed |= sent < np.iinfo(np.int64).max
+        usable = timed[index]
+        delay = (timestamps - polled[index]).astype(np.float64)[usable]
+        members = self.member[first][usable]
+        totals = np.bincount(members, weights=delay, minlength=len(self.names))
+        counts = np.bincount(members, minlength=len(self.names))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return totals / counts
+
+    def turnout(self):
+        # (game timestamps, players per game)
+        final = self.last & (self.reply == REPLIES['yes'])
+        games, index = np.unique(self.game, return_inverse=True)
+        players = np.bincount(index[final], weights=1 + self.sub[final], minlength=len(games))
+        return games, players.astype(np.int64)
+
+
+def seasons(games):
+    # season (calendar year) of each game timestamp
+    return games.astype('datetime64[s]').astype('datetime64[Y]').astype(np.int64) + 1970
+
+
+def trend(players, count=TREND_GAMES):
+    # change in players per game over the last `count` games (least squares slope)
+    recent = players[-count:]
+    if len(recent) < 2:
+        return 0.0
+    return float(np.polyfit(np.arange(len(recent)), recent, 1)[0])
+
+
+def columns(names, games, replies, subs, timestamps):
+    # one batch of rows as arrays: reply strings become REPLIES codes, missing subs become 0
+    replies = np.asarray(replies, dtype=str)
+    codes = np.zeros(len(replies), dtype=np.int8)
+    for reply, code in REPLIES.items():
+        codes[replies == reply] = code
+    subs = np.fromiter((int(sub or 0) for sub in subs), np.int32, len(subs))  # None, '', 0 and '2' all occur
+    return (np.asarray(names, dtype=str), np.asarray(games, dtype=np.int64), codes, subs,
+            np.asarray(timestamps, dtype=np.int64))
+
+
+def concatenate(chunks):
+    if not chunks:
+        return columns([], [], [], [], [])
+    return tuple(np.concatenate(column) for column in zip(*chunks))
+
+
+def read_store(db):
+    return concatenate([columns(*zip(*batch)) for batch in db.scan_rsvps() if batch])
+
+
+def read_csv_dir(rsvp_dir, game_of):
+    # the final reply per player from each <game_date>.csv and the journal program.py appends to
+    #  (replies not compacted into the CSV yet); no reply times in these files
+    chunks = []
+    games = set(os.path.splitext(path)[0] for pattern in ['*.csv', '*.journal']
+                for path in glob.glob(os.path.join(rsvp_dir, pattern)))
+    for base in sorted(games):
+        rows = list(journal.read_rows(base + '.csv').values())
+        if rows:
+            game = game_of(os.path.basename(base))
+            names = [row['name'].strip() for row in rows]
+            replies = ['yes' if row['rsvp'].strip() == 'y' else 'no' for row in rows]
+            chunks.append(columns(names, [game] * len(rows), replies, [0] * len(rows), [-1] * len(rows)))
+    return concatenate(chunks)
+
+
+def load(db=None, rsvp_dir=RSVP_DIR):
+    # RSVP table plus CSV history. CSV rows for a game and player already in the table (imported) are skipped
+    db = db or store.get_store()
+    rows = read_store(db)
+    if rsvp_dir and os.path.isdir(rsvp_dir):
+        old = read_csv_dir(rsvp_dir, lambda game_date: app.get_next_game(game_date).timestamp)
+        seen = np.char.add(np.char.add(rows[0], '@'), rows[1].astype(str))
+        keep = ~np.isin(np.char.add(np.char.add(old[0], '@'), old[1].astype(str)), seen)
+        rows = concatenate([rows, tuple(column[keep] for column in old)])
+    return History(*rows)
+
+
+def member_report(history, name, invites=(), hours=FLAKE_HOURS):
+    matches = np.nonzero(history.names == name)[0]
+    if not len(matches):
+        return 'No history for {}'.format(name)
+    i = matches[0]
+    attended, eligible = history.attendance()
+    flakes, late = history.flakes(hours)
+    latency = history.latency(invites)
+    report = '{}: played {} of {} games ({:.0%}), {} flakes ({} inside {}h)'.format(
+        name, attended[i], eligible[i], attended[i] / max(eligible[i], 1), flakes[i], late[i], hours)
+    if not np.isnan(latency[i]):
+        report += ', replies {:.1f}h after the poll'.format(latency[i] / 3600)
+    return report
+
+
+def group_report(history, invites=(), hours=FLAKE_HOURS, top=3):
+    if not len(history):
+        return 'No RSVP history yet'
+    attended, eligible = history.attendance()
+    flakes, late = history.flakes(hours)
+    latency = history.latency(invites)
+    games, players = history.turnout()
+    season = seasons(games)
+    lines = ['{} games, {} replies, avg {:.1f} players ({:+.1f}/game over the last {})'.format(
+        len(games), len(history), players.mean(), trend(players), min(len(games), TREND_GAMES))]
+    years, index = np.unique(season, return_inverse=True)
+    averages = np.bincount(index, weights=players) / np.bincount(index)
+    lines.append('Seasons: ' + ', '.join('{} {:.1f}'.format(year, avg) for year, avg in zip(years, averages)))
+    rate = attended / np.maximum(eligible, 1)
+    best = np.argsort(-rate, kind='stable')[:top]
+    lines.append('Most games: ' + ', '.join('{} {:.0%}'.format(history.names[i], rate[i]) for i in best))
+    worst = [i for i in np.argsort(-late, kind='stable')[:top] if late[i]]
+    if worst:
+        lines.append('Late flakes: ' + ', '.join('{} {}'.format(history.names[i], late[i]) for i in worst))
+    if not np.all(np.isnan(latency)):
+        lines.append('Median reply: {:.1f}h after the poll'.format(np.nanmedian(latency) / 3600))
+    return '\n'.join(lines)
+
+
+def report(name=None, db=None, rsvp_dir=RSVP_DIR, hours=FLAKE_HOURS, top=3):
+    db = db or store.get_store()
+    history = load(db, rsvp_dir)
+    invites = db.get_invites()
+    if name:
+        return member_report(history, name, invites, hours)
+    return group_report(history, invites, hours, top)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Attendance analytics over the RSVP history')
+    parser.add_argument('name', nargs='?', help='one member instead of the whole group')
+    parser.add_argument('--flake-hours', type=float, default=FLAKE_HOURS)
+    parser.add_argument('--rsvp-dir', default=RSVP_DIR, help="CSV history, '' to skip")
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+    print(report(args.name, rsvp_dir=args.rsvp_dir, hours=args.flake_hours, top=args.top))
+
+
+if __name__ == '__main__':
+    main()
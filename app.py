@@ -1,7 +1,7 @@
 """
 X 1. Allow Admins to push poll to members
 X 2. Allow Admins to push poll reminder to Members who have not yet RSVP'd
-3. Add STANDBY list of favorable subs to push invite to them with limited space available
+X 3. Add STANDBY list of favorable subs to push invite to them with limited space available
 X 4. Update Admins if member changes RSVP
 X 5. Send non-RSVP responses from Members to Admins
 X 6. Allow members to RSVP for their guest subs
@@ -15,206 +15,317 @@ X 8. Allow Admins to send out messages to list for updates or fee collections
 # Game = "17": {"game": 1503630000, "timestamp": 1503639064, "sub": "2", "name": "Testman", "reply": "yes"}
 
 import arrow
-from tinydb import TinyDB, Query
 
+import commands
 import config
-import re
+import digest
+import fanout
+import groups
+import metrics
+import outbox
+import schedule
+import segments
 import sms
+import standby
+import store
+
+STATUS_LAYOUT = getattr(config, 'status_layout', 'full')  # 'full': a line per member, 'compact': a line per reply
+STATUS_SEGMENTS = getattr(config, 'status_page_segments', 0)  # split the 'L' reply into pages this long. 0 for one page
+STATUS_MORE = "({page}/{pages}) Reply 'L {next}' for more"
 
 
 def main(phone, message):
-    result = re.search('^[a-zA-Z]', message)
-    try:
-        command = result.group(0).lower()
-        if command in ['y', 'n', 'yes', 'no']:
-            return update_rsvp(phone, message)
-        elif command in ['l']:
-            return send_rsvp_status(get_next_game())
-        else:
-            # 5. Send non-RSVP responses from Members to Admins
-            member = get_member(phone)
-            return notify_admin("{} said: {}".format(member['name'], message))
-    except AttributeError:
-        pass
-
-    if is_admin(phone):
-        result = re.search('^([?!])\s?(.*)', message)
-        try:
-            command = result.group(1)
-            message = result.group(2)
-            return admin_commands['command_' + command](message)
-        except AttributeError:
-            pass
+    # parsed once; words are member commands (anything unknown is forwarded to the admins),
+    #  symbols are admin commands
+    command = commands.parse(phone, message)
+    if command.word is not None:
+        kind, handler = member_commands.get(command.key, ('forward', forward_message))
+        return dispatch(kind, handler, command)
+    if command.symbol in admin_commands and command.is_admin:
+        kind, handler = admin_commands[command.symbol]
+        return dispatch(kind, handler, command)
+    metrics.inc('commands_total', command='unknown')
     return None
 
 
+def dispatch(kind, handler, *args):
+    # count and time each command type
+    metrics.inc('commands_total', command=kind)
+    with metrics.span('dispatch', command=kind):
+        return handler(*args)
+
+
 # 8. Allow Admins to send out messages to list for updates or fee collections
 def member_broadcast(message):
     if message.strip():
+        message = segments.to_gsm(message)
         members = get_members()
-        for member in members:
-            send_message(member, message)
-        return 'Member broadcast sent: "{}"'.format(message)
+        jobs = [(member, message) for member in members]
+        cost = cost_note(jobs)
+        summary = send_messages(jobs)
+        return 'Member broadcast sent{}{}: "{}"'.format(cost, delivery_note(summary), message)
     return 'Message not sent'
 
 
 # 1. Allow Master Member to push poll to members
-def send_invite(members=None):
+def send_invite(members=None, game=None):
     # Include list of Members to send to specific people (aka those not yet RSVP's).
-    #  Otherwise, send to all Members.
+    #  Otherwise, send to all Members. The game defaults to the next one.
 
     # create message
-    next_game = get_next_game()
+    next_game = game or get_next_game()
+    day, time = next_game.format('dddd'), next_game.format('h:mm A')
     message = "will you be playing this {} at {}? Please reply with a 'yes' or 'no'. " \
-              "Add a number after if you're bringing a guest: 'yes 2' for two subs.".format(next_game.format('dddd'),
-                                                                                            next_game.format('h:mm A'))
+              "Add a number after if you're bringing a guest: 'yes 2' for two subs.".format(day, time)
+    # shorter wordings for when a long (or non GSM-7) name pushes the invite past one segment
+    short = "playing {} at {}? Reply 'yes' or 'no', or 'yes 2' if you're bringing two subs.".format(day, time)
     if members is None:
         # get all members from list
         members = get_members()
 
     # send message to each member
-    for member in members:
-        if not config.testing:
-            send_message(member, '{}, {}'.format(member['name'], message))
-        else:
-            print('{}, '.format(member['name']) + message)
+    jobs = [(member, segments.fit(['{}, {}'.format(member['name'], message), '{}, {}'.format(member['name'], short),
+                                   short[0].upper() + short[1:]])) for member in members]
+    # projected cost, logged before anything goes out
+    cost = cost_note(jobs)
+    summary = send_messages(jobs)
+    # remembered for analytics (reply latency)
+    store.get_store().log_invite(next_game.timestamp, arrow.now().timestamp)
 
     # acknowledge invite was sent
-    return "RSVP poll has been sent to {} players.".format(len(members))
+    return "RSVP poll has been sent to {} players{}{}.".format(len(members), cost, delivery_note(summary))
 
 
 # 1.1 Handle user's RSVP response
-def update_rsvp(phone, message):
+def update_rsvp(command):
     # get member by phone and ...
-    members = get_members()
-    Member = Query()
-    results = members.search(Member.phone == phone)
-    if len(results) == 1:
-        member = results[0]
-    else:
+    member = command.member
+    if member is None:
         return 'ERROR: Search results invalid'
     # ... upcoming game
     game = get_next_game()
     # quantify response
-    command = re.search(r"^([a-zA-Z]*)\s?(\d)?", message)
-    if command.group(1).lower() in ['y', 'yes']:
+    if command.word.lower() in ['y', 'yes']:
         reply = 'yes'
-    elif command.group(1).lower() in ['n', 'no']:
+    elif command.word.lower() in ['n', 'no']:
         reply = 'no'
     else:
         # error
-        return 'ERROR: Not a valid response: "{}"'.format(command.group(1))
-    sub = command.group(2)
+        return 'ERROR: Not a valid response: "{}"'.format(command.word)
+    sub = command.digit
     rsvp_message = reply.capitalize()
     if sub:
         rsvp_message += ' with {} sub(s)'.format(sub)
-    set_rsvp(game, member, reply, sub)
+    recorded = set_rsvp(game, member, reply, sub)
+    if recorded == 'standby':
+        return "The next game is full, so you're on the STANDBY list. We'll text you if a spot opens up!"
+    if recorded == 'full':
+        current = store.get_store().get_rsvp(game.timestamp, member['name'])
+        return "The next game is full, so you're still in{}.".format(
+            ' with {} sub(s)'.format(current['sub']) if current['sub'] else '')
     return 'Thank you for RSVPing {} to the next game!'.format(rsvp_message)
 
 
 def set_rsvp(game, member, reply, sub):
-    # check for current RSVP
-    db = TinyDB(config.db_file)
-    rsvps = db.table('RSVP')
-    RSVP = Query()
-    results = rsvps.search((RSVP.game == game.timestamp) & (RSVP.name == member['name']))
-    rsvp = {}  # dict for insert/update
+    # returns the reply recorded, which is 'standby' instead of 'yes' when the game is full, or 'full'
+    #  when a member who is already in asked for more subs than fit (their 'yes' stands)
+    db = store.get_store()
+    with db.lock:
+        # check for current RSVP
+        newest_reply = db.get_rsvp(game.timestamp, member['name'])
+        full = False
+        # 3. A 'yes' that doesn't fit goes on the STANDBY list, unless the member already has a spot
+        if reply == 'yes' and not standby.fits(db, game.timestamp, sub, newest_reply):
+            if newest_reply is not None and newest_reply['reply'] == 'yes':
+                full = True
+                sub = newest_reply['sub']
+            else:
+                reply = 'standby'
+        changed = newest_reply is None or reply != newest_reply['reply'] or sub != newest_reply['sub']
+        if changed or (reply != 'standby' and not full):
+            # Add/Update RSVP reply (a repeated standby keeps its place in line)
+            rsvp = {'name': member['name'], 'game': game.timestamp, 'reply': reply, 'sub': sub,
+                    'timestamp': arrow.now().timestamp}
+            db.insert_rsvp(rsvp)
+            if reply == 'standby':
+                standby.add(db, game.timestamp, rsvp)
+        # fill any spots that just opened up
+        promoted = standby.promote(db, game.timestamp)
+        if promoted:
+            now = arrow.now().timestamp
+            db.insert_rsvps([dict(_, reply='yes', timestamp=now) for _ in promoted])
     # Check for existing RSVP and note any changes
-    if len(results) > 0:
-        # We'll have to get all replies and then sort to find newest one
-        newest_reply = max(results, key=lambda r: r['timestamp'])
-        if reply != newest_reply['reply'] or sub != newest_reply['sub']:
+    if newest_reply is not None:
+        if changed:
             # notify Admins of change
             notify_admin('{} changed RSVP to {} with {} subs!'.format(member['name'], reply,
-                                                                      sub if sub is not None else 0))
+                                                                      sub if sub is not None else 0),
+                         key=('rsvp', member['name']))
         else:
             print('RSVP is the same')
-    # Add/Update RSVP reply
-    rsvp = {'name': member['name'], 'game': game.timestamp, 'reply': reply, 'sub': sub,
-            'timestamp': arrow.now().timestamp}
-    rsvps.insert(rsvp)
+    if promoted:
+        send_standby_invites(game, promoted)
+    return 'full' if full else reply
+
+
+def send_standby_invites(game, promoted):
+    # one batch for everyone who moved up from STANDBY
+    message = "a spot opened up for {} at {}, you're IN! Reply 'no' if you can't make it.".format(
+        game.format('dddd'), game.format('h:mm A'))
+    members = [_ for _ in [store.get_store().get_member_by_name(rsvp['name']) for rsvp in promoted] if _]
+    send_messages([(member, '{}, {}'.format(member['name'], message)) for member in members])
+    notify_admin('Moved up from STANDBY: {}'.format(', '.join(rsvp['name'] for rsvp in promoted)), urgent=True)
+
+
+# 1.2 Let members see RSVP list ('L 2' for the second page)
+def send_list(command):
+    return send_rsvp_status(get_next_game(), command.number or 1)
 
 
-# 1.2 Let members see RSVP list
 def get_game_rsvps(game):
-    db = TinyDB(config.db_file)
-    rsvps = db.table('RSVP')
-    Rsvp = Query()
-    results = rsvps.search(Rsvp.game == game.timestamp)
-    players = {}  # string to return for testing
-    for player in results:
-        if 'name' not in players or players['name'] is None:
-            players[player['name']] = player
-        elif player['timestamp'] > players[player['name']]['timestamp']:
-            players[player['name']] = player
-    return players
-
-
-def send_rsvp_status(game):
-    players = get_game_rsvps(game)
-    response = ''
-    spots = {'yes': 0, 'no': 0, 'sub': 0}
+    # {name: newest RSVP}, kept current by the store on every write
+    return store.get_store().get_game_rsvps(game.timestamp)
+
+
+def send_rsvp_status(game, page=1):
+    db = store.get_store()
+    # game timestamp -> (version, testing, rendered pages). Rebuilt only after an RSVP for that game changes
+    status_cache = db.views.setdefault('status', {})
+    version = db.game_version(game.timestamp)
+    cached = status_cache.get(game.timestamp)
+    if cached is not None and cached[0] == version and cached[1] == config.testing:
+        pages = cached[2]
+    else:
+        pages = render_rsvp_status(db.get_game_rsvps(game.timestamp))
+        status_cache[game.timestamp] = (version, config.testing, pages)
+    return pages[min(max(page, 1), len(pages)) - 1]
+
+
+def render_rsvp_status(players, layout=STATUS_LAYOUT, max_segments=STATUS_SEGMENTS):
+    # list of pages, a single one unless max_segments is set
+    lines = []
+    spots = {'yes': 0, 'no': 0, 'sub': 0, 'standby': 0}
+    compact = {'yes': [], 'standby': [], 'no': []}
     for key, rsvp in players.items():
         spots[rsvp['reply']] += 1
-        response += '{}: {}'.format(rsvp['name'], rsvp['reply'].capitalize())
+        line = '{}: {}'.format(rsvp['name'], rsvp['reply'].capitalize())
+        short = rsvp['name']
         if rsvp['sub'] and int(rsvp['sub']) > 0:
-            spots['sub'] = spots['sub'] + int(rsvp['sub'])
-            response += ' and is bringing {} sub{}'.format(rsvp['sub'], 's' if int(rsvp['sub']) > 1 else '')
-        response += "\n"
-    response = "Yes: {} No: {} Subs: {} (Total Players: {})\n --- --- --- \n{}".format(spots['yes'], spots['no'],
-                                                                                       spots['sub'],
-                                                                                       spots['yes'] + spots['sub'],
-                                                                                       response)
-    if config.testing:
-        response = "!"*20 + "\n!! TEST TEST TEST !!\n" + "!"*20 + "\n" + response
-    return response
+            if rsvp['reply'] != 'standby':
+                spots['sub'] = spots['sub'] + int(rsvp['sub'])
+            line += ' and is bringing {} sub{}'.format(rsvp['sub'], 's' if int(rsvp['sub']) > 1 else '')
+            short += '+{}'.format(rsvp['sub'])
+        lines.append(line)
+        compact[rsvp['reply']].append(short)
+    if layout == 'compact':
+        header = "Yes {} No {} Subs {} Total {}".format(spots['yes'], spots['no'], spots['sub'],
+                                                        spots['yes'] + spots['sub'])
+        if spots['standby']:
+            header += ' Standby {}'.format(spots['standby'])
+        if config.testing:
+            header = 'TEST ' + header
+        # grouped by reply, a name per line so pages can break anywhere
+        lines = []
+        for reply, names in compact.items():
+            if names:
+                lines += ['{}: {}'.format(reply.capitalize(), names[0])] + names[1:]
+    else:
+        header = "Yes: {} No: {} Subs: {} (Total Players: {})".format(spots['yes'], spots['no'], spots['sub'],
+                                                                    spots['yes'] + spots['sub'])
+        if spots['standby']:
+            header += ' Standby: {}'.format(spots['standby'])
+        header += "\n --- --- --- "
+        if config.testing:
+            header = "!"*20 + "\n!! TEST TEST TEST !!\n" + "!"*20 + "\n" + header
+    if not max_segments:
+        return ['\n'.join([header] + lines) + ('\n' if layout != 'compact' else '')]
+    return segments.paginate(header, lines, max_segments, STATUS_MORE)
 
 
 # 2. Allow Admins to push poll reminder to Members who have not yet RSVP'd
-def send_reminder(*args):
+def send_reminder(*args, game=None):
     # get list of Members that haven't RSVP'd
     all_members = get_members()
-    game = get_next_game()
+    game = game or get_next_game()
     rsvpd_players = get_game_rsvps(game)
     members = [member for member in all_members if member['name'] not in rsvpd_players]
     # send message to those Members
-    return send_invite(members)
+    return send_invite(members, game=game)
+
+
+# 5. Send non-RSVP responses from Members to Admins
+def forward_message(command):
+    return notify_admin("{} said: {}".format(command.member['name'], command.text))
 
 
 # 4. Update Admins if member changes RSVP
-def notify_admin(message):
-    for admin in get_admins():
-        send_message(admin, message)
+def notify_admin(message, urgent=False, key=None):
+    # batched into a digest when config.admin_digest_seconds is set, unless urgent. A later message
+    #  with the same key replaces one still waiting in the digest
+    metrics.inc('admin_notifications_total')
+    group = groups.current()
+    admins_digest = digest.get_digest(groups.bind(send_admins), group.name if group is not None else None)
+    admins_digest.add(message, urgent, key)
+
+
+def send_admins(message):
+    send_messages([(admin, message) for admin in get_admins()])
 
 
 # Utility Functions
 def send_message(member, message):
     if not config.testing:
-        sms.send_sms(member['phone'], message)
+        # queued messages carry the number they are sent from
+        sms.send_sms(member['phone'], message, member.get('sender'))
     else:
         print('Sending to {}:'.format(member['name']), message)
     pass
 
 
+def send_messages(jobs):
+    # jobs: list of (member, message) pairs. Queued for the outbox worker when config.outbox_file is set,
+    #  so the webhook can reply without waiting on Twilio
+    queue = start_outbox()
+    if queue is None:
+        return deliver_messages(jobs)
+    return {'sent': 0, 'failed': 0, 'queued': queue.enqueue(jobs, sms.sender()), 'results': []}
+
+
+def deliver_messages(jobs):
+    # send now, concurrently within the account's rate limit
+    if config.testing:
+        # nothing leaves the box, so don't throttle the console output
+        return fanout.dispatch(jobs, send_message, rate=0, workers=1)
+    return fanout.dispatch(jobs, send_message)
+
+
+def start_outbox():
+    queue = outbox.get_outbox()
+    if queue is not None:
+        queue.start(deliver_messages)
+    return queue
+
+
+def cost_note(jobs):
+    # projected SMS segments for a batch, noted in the admin's acknowledgement
+    cost = segments.cost(body for member, body in jobs)
+    print('Sending {} messages, {} segments ({} UCS-2)'.format(cost['messages'], cost['segments'], cost['ucs2']))
+    return ' ({} segments)'.format(cost['segments'])
+
+
+def delivery_note(summary):
+    if summary['failed']:
+        return ' ({} failed)'.format(summary['failed'])
+    return ''
+
+
 def is_admin(phone):
-    results = get_member(phone)
-    if not results:
-        # phone number doesn't belong to a member
-        return False
-    db = TinyDB(config.db_file)
-    admin_tbl = db.table('Admin')
     # is that Member in Admin list?
-    if results[0]['name'] in [_['name'] for _ in admin_tbl.all()]:
-        # Member is in Admin group
-        return True
-    return False
-    # Member was not found in Admin group
+    return store.get_store().is_admin(phone)
 
 
 def get_admins():
-    members = get_members()
-    admins = [member for member in members if is_admin(member['phone'])]
-    return admins
+    return store.get_store().get_admins()
 
 
 def is_member(phone):
@@ -226,46 +337,49 @@ def is_member(phone):
 
 
 def get_member(phone):
-    db = TinyDB(config.db_file)
-    member_tbl = db.table('Member')
     # does the Phone match a Member
-    Member = Query()
-    results = member_tbl.search(Member.phone == phone)
-    if len(results) != 1:
+    member = store.get_store().get_member(phone)
+    if member is None:
         return False
-    return results
+    return [member]
 
 
 def get_members():
-    db = TinyDB(config.db_file)
-    members = db.table('Member')
-    return members
+    return store.get_store().get_members()
 
 
 def get_next_game(game_date=None):  # returns Arrow object for next game
     if game_date is None:
-        today = arrow.now()
-        # find days till next game day. If today is game day, return zero.
-        days_till_game = config.event_weekday - today.isoweekday()
-        # adjust date to next game date
-        if days_till_game < 0:
-            days_till_game += 7
-        next_game = today.shift(days=days_till_game)
-    else:
-        next_game = arrow.get(game_date, 'YYYY-MM-DD', tzinfo='US/Pacific')
+        # shared, precomputed schedule; cached until the game rolls over
+        return schedule.get_schedule().next_game()
+    next_game = arrow.get(game_date, 'YYYY-MM-DD', tzinfo='US/Pacific')
 
     # adjust to next game time
     next_game = next_game.replace(hour=config.event_hour, minute=config.event_minute)
     return next_game.floor('minute')
 
 
+# Command tables for main: key -> (metrics label, handler(command))
 member_commands = {
-
+    'y': ('rsvp', update_rsvp),
+    'n': ('rsvp', update_rsvp),
+    'l': ('list', send_list),
 }
 
+
+# Attendance stats for the group, or for one member ('# Name')
+def send_stats(name):
+    try:
+        import analytics
+    except ImportError:
+        return 'Stats need numpy: pip install -e .[analytics]'
+    return analytics.report(name.strip() or None)
+
+
 admin_commands = {
-    'command_?': send_reminder,
-    'command_!': member_broadcast
+    '?': ('admin?', lambda command: send_reminder()),
+    '!': ('admin!', lambda command: member_broadcast(command.rest)),
+    '#': ('admin#', lambda command: send_stats(command.rest)),
 }
 
 
@@ -0,0 +1,165 @@
+###
+# Season archives for the RSVP table
+#
+# python archive.py [--keep 1]     - archive every season but the last --keep (this one included)
+#
+# Stop the server first unless it runs with db_shared: its cached copy of the database would put the
+# archived RSVPs back on its next write. archive.py refuses to run while the database is open.
+# archive_keep_seasons archives at startup instead.
+#
+# A season is a calendar year of games. Archiving a season keeps only the final reply per member per
+# game, writes it to <archive dir>/rsvp-<season>.json.gz (read only) and deletes it from the live
+# table, so the database the server loads stays the size of the current season. index.json keeps
+# each season's games and attendance counts, which is all the server needs day to day; the season
+# files themselves are only opened when an archived game is asked for (history, analytics).
+##
+import argparse
+import gzip
+import json
+import os
+import stat
+import threading
+from collections import OrderedDict
+
+import arrow
+
+import coherence
+import config
+import store
+
+ARCHIVE_DIR = getattr(config, 'archive_dir', None)  # None: <db file name>-archive next to the database
+KEEP_SEASONS = getattr(config, 'archive_keep_seasons', 0)  # archive at startup keeping this many seasons. 0: never
+OPEN_SEASONS = 2  # season files kept in memory once read
+
+
+def archive_dir(db_file):
+    return ARCHIVE_DIR or os.path.splitext(db_file)[0] + '-archive'
+
+
+def season_of(game):
+    return arrow.get(game).to(getattr(config, 'event_timezone', 'local')).year
+
+
+def season_start(season):
+    # the first timestamp of a season
+    return arrow.get(str(season), 'YYYY', tzinfo=getattr(config, 'event_timezone', 'local')).timestamp
+
+
+def final_replies(rsvps):
+    # the newest reply per (game, name)
+    final = {}
+    for rsvp in sorted(rsvps, key=lambda r: r['timestamp']):
+        final[(rsvp['game'], rsvp['name'])] = rsvp
+    return list(final.values())
+
+
+class Archive(object):
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.index = self.read_index()  # season -> {'games': [...], 'attendance': {name: games}}
+        self.games = set(game for entry in self.index.values() for game in entry['games'])
+        self.open = OrderedDict()  # season -> {game: {name: rsvp}}, least recently used first
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def read_index(self):
+        try:
+            with open(self.path('index.json')) as f:
+                return dict((int(season), entry) for season, entry in json.load(f).items())
+        except (IOError, ValueError):
+            return {}
+
+    def write_file(self, name, data, compress=False):
+        # written aside and renamed over the old file, then made read only
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self.path(name + '.tmp')
+        with (gzip.open(tmp, 'wt') if compress else open(tmp, 'w')) as f:
+            json.dump(data, f)
+        os.chmod(tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(tmp, self.path(name))
+
+    def seasons(self):
+        return sorted(self.index)
+
+    def has_game(self, game):
+        return game in self.games
+
+    def attendance(self):
+        # name -> archived games finished on 'yes', all seasons
+        totals = {}
+        for entry in self.index.values():
+            for name, count in entry['attendance'].items():
+                totals[name] = totals.get(name, 0) + count
+        return totals
+
+    def read_season(self, season):
+        # {game: {name: final RSVP}} for one archived season, read on demand
+        with self.lock:
+            games = self.open.get(season)
+            if games is not None:
+                self.open.move_to_end(season)
+                return games
+            games = {}
+            if season in self.index:
+                with gzip.open(self.path('rsvp-{}.json.gz'.format(season)), 'rt') as f:
+                    for rsvp in json.load(f):
+                        games.setdefault(rsvp['game'], {})[rsvp['name']] = rsvp
+            self.open[season] = games
+            while len(self.open) > OPEN_SEASONS:
+                self.open.popitem(last=False)
+            return games
+
+    def game_rsvps(self, game):
+        return dict(self.read_season(season_of(game)).get(game, {}))
+
+    def history(self, game, name=None):
+        rsvps = sorted(self.game_rsvps(game).values(), key=lambda r: r['timestamp'])
+        return [r for r in rsvps if name is None or r['name'] == name]
+
+    def scan(self):
+        # every archived RSVP as (name, game, reply, sub, timestamp) tuples, a season at a time
+        for season in self.seasons():
+            yield [(r['name'], r['game'], r['reply'], r.get('sub'), r['timestamp'])
+                   for game in self.read_season(season).values() for r in game.values()]
+
+    def add(self, rsvps):
+        # merge RSVPs (any number of seasons) into the archive, keeping the final reply per member per game
+        by_season = {}
+        for rsvp in rsvps:
+            by_season.setdefault(season_of(rsvp['game']), []).append(rsvp)
+        for season, new in sorted(by_season.items()):
+            old = [r for game in self.read_season(season).values() for r in game.values()]
+            rows = sorted(final_replies(old + new), key=lambda r: (r['game'], r['timestamp']))
+            self.write_file('rsvp-{}.json.gz'.format(season), rows, compress=True)
+            attendance = {}
+            for rsvp in rows:
+                if rsvp['reply'] == 'yes':
+                    attendance[rsvp['name']] = attendance.get(rsvp['name'], 0) + 1
+            with self.lock:
+                self.index[season] = {'games': sorted(set(r['game'] for r in rows)), 'attendance': attendance}
+                self.games.update(self.index[season]['games'])
+                self.open.pop(season, None)
+            self.write_file('index.json', self.index)
+        return len(by_season)
+
+
+def archive_seasons(db, keep=1):
+    # move every season before the last `keep` out of the store into its archive
+    cutoff = season_start(arrow.now(getattr(config, 'event_timezone', 'local')).year - keep + 1)
+    return db.archive_before(cutoff)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move past seasons of RSVPs into compressed archives')
+    parser.add_argument('--keep', type=int, default=KEEP_SEASONS or 1, help='seasons kept live, this one included')
+    args = parser.parse_args()
+    coherence.check_offline(config.db_file)
+    db = store.get_store()
+    moved = archive_seasons(db, args.keep)
+    print('Archived {} RSVPs into {}'.format(moved, db.archive.directory))
+
+
+if __name__ == '__main__':
+    main()
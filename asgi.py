@@ -0,0 +1,85 @@
+###
+# asyncio (ASGI) server mode for the SMS webhook, for reply bursts after a poll goes out
+#
+# uvicorn asgi:app --port 6543        (or: python asgi.py)
+#
+# Serves the same /dweb/ and /metrics endpoints as run.py. Requests are parsed on the event loop;
+# app.main and the store run on a thread pool so file I/O never blocks other replies. Outgoing SMS
+# are left to the outbox worker (config.outbox_file) rather than sent while the reply waits.
+##
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+import app as rsvp_app
+import config
+import metrics
+import run
+import scheduler
+
+THREADS = getattr(config, 'asgi_threads', 32)
+PORT = getattr(config, 'asgi_port', 6543)
+
+executor = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix='webhook')
+
+
+def startup():
+    run.init_db()
+    # send anything left in the outbox from before a restart
+    rsvp_app.start_outbox()
+    # polls and reminders from config.reminder_offsets
+    scheduler.start()
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+async def respond(send, status, body, content_type):
+    body = body.encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await asyncio.get_running_loop().run_in_executor(executor, startup)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    path = scope['path']
+    parts = path.strip('/').split('/')
+    if parts[0] == 'dweb' and len(parts) <= 2 and path.endswith('/') and scope['method'] in ('GET', 'POST'):
+        # /dweb/ or /dweb/<group>/
+        # same precedence as Flask's request.values: query string first, then the form
+        values = dict(parse_qsl((await read_body(receive)).decode('utf-8'), keep_blank_values=True))
+        values.update(parse_qsl(scope.get('query_string', b'').decode('utf-8'), keep_blank_values=True))
+        group = parts[1] if len(parts) == 2 else None
+        twiml = await asyncio.get_running_loop().run_in_executor(executor, run.handle_sms, values, path, group)
+        return await respond(send, 200, twiml, 'text/xml; charset=utf-8')
+    if path == '/metrics' and metrics.ENABLED:
+        return await respond(send, 200, metrics.render(), 'text/plain; version=0.0.4')
+    await respond(send, 404, 'Not Found', 'text/plain')
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, port=PORT)
@@ -0,0 +1,41 @@
+###
+# Local stand-in for the Twilio Messages API, for benchmarks
+##
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeTwilio(BaseHTTPRequestHandler):
+    # Answers POST /2010-04-01/Accounts/<sid>/Messages.json like the real API, with a fixed delay
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes; without this keep-alive clients hit delayed ACKs
+    disable_nagle_algorithm = True
+    latency = 0.15
+    error_rate = 0.0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            status, body = 429, {'code': 20429, 'message': 'Too Many Requests'}
+        else:
+            status, body = 201, {'sid': 'SM%032x' % random.getrandbits(128), 'status': 'queued'}
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server():
+    # serves on a free port in a background thread; server.server_address[1] is the port
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeTwilio)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,73 @@
+###
+# Throughput of sequential sends vs fanout.dispatch against a local fake Twilio endpoint
+#
+# python benchmarks/fanout.py [--latency 0.15] [--rate 0] [--workers 16] [--errors 0.02]
+##
+import argparse
+import http.client
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import fanout
+from fake_twilio import FakeTwilio, start_server
+
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        super(HTTPError, self).__init__('HTTP {}'.format(status))
+        self.status = status
+
+
+def make_sender(port):
+    local = threading.local()
+
+    def send(member, body):
+        # one keep-alive connection per worker thread
+        if not hasattr(local, 'conn'):
+            local.conn = http.client.HTTPConnection('127.0.0.1', port)
+        local.conn.request('POST', '/2010-04-01/Accounts/ACxxx/Messages.json',
+                           urlencode({'To': member['phone'], 'From': '+15555555555', 'Body': body}),
+                           {'Content-Type': 'application/x-www-form-urlencoded'})
+        response = local.conn.getresponse()
+        response.read()
+        if response.status >= 400:
+            raise HTTPError(response.status)
+    return send
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.15, help='fake API round trip in seconds')
+    parser.add_argument('--rate', type=float, default=0, help='token bucket rate, 0 for no limit')
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--errors', type=float, default=0.0, help='fraction of requests answered with 429')
+    parser.add_argument('--sizes', default='10,100,1000')
+    parser.add_argument('--skip-sequential-over', type=int, default=100)
+    args = parser.parse_args()
+
+    FakeTwilio.latency = args.latency
+    FakeTwilio.error_rate = args.errors
+    server = start_server()
+    send = make_sender(server.server_address[1])
+
+    print('{:>6} {:>14} {:>14} {:>8} {:>8}'.format('n', 'sequential/s', 'fanout/s', 'sent', 'failed'))
+    for n in [int(_) for _ in args.sizes.split(',')]:
+        jobs = [({'name': 'Member{}'.format(i), 'phone': '+1555{:07d}'.format(i)}, 'benchmark') for i in range(n)]
+        sequential = '-'
+        if n <= args.skip_sequential_over:
+            started = time.monotonic()
+            fanout.dispatch(jobs, send, rate=args.rate, workers=1, retries=0)
+            sequential = '{:.1f}'.format(n / (time.monotonic() - started))
+        summary = fanout.dispatch(jobs, send, rate=args.rate, workers=args.workers, backoff=0.05)
+        print('{:>6} {:>14} {:>14.1f} {:>8} {:>8}'.format(n, sequential, n / summary['seconds'],
+                                                        summary['sent'], summary['failed']))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
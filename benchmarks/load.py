@@ -0,0 +1,147 @@
+###
+# Burst load test: hundreds of concurrent inbound replies against the Flask (run.py) and asyncio (asgi.py) servers
+#
+# python benchmarks/load.py [--requests 1000] [--concurrency 300] [--members 300] [--modes flask,asgi]
+#                           [--send-latency 0.2]
+#
+# Each mode runs in its own process on a throwaway database. Outgoing SMS go to a stub transport that
+# sleeps --send-latency seconds, standing in for the Twilio API.
+##
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from storage import synthetic_members, write_db
+
+BOOT = """
+import sys, time
+sys.path[:0] = {paths!r}
+import config
+config.db_file = {db_file!r}
+config.db_backend = {backend!r}
+config.testing = False
+import dedupe, fanout, outbox, sms, store
+store.DB_BACKEND = {backend!r}
+outbox.OUTBOX_FILE = {outbox_file!r}
+dedupe.DEDUPE_FILE = {dedupe_file!r}
+fanout.RATE = 0
+sms.set_transport(lambda DID_to, DID_from, body: time.sleep({send_latency!r}))
+"""
+
+SERVE = {
+    'flask': "import run\nrun.init_db()\nrun.wsgi.run(port={port}, threaded=True)\n",
+    'asgi': "import asgi, uvicorn\nuvicorn.run(asgi.app, port={port}, log_level='warning', backlog=4096)\n",
+}
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def wait_for(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+async def post(port, form):
+    # a fresh connection per request, like Twilio
+    body = urlencode(form).encode()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(b'POST /dweb/ HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n'
+                 b'Content-Type: application/x-www-form-urlencoded\r\n'
+                 b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return int(response.split(b' ', 2)[1])
+
+
+async def burst(port, members, requests, concurrency):
+    limit = asyncio.Semaphore(concurrency)
+    timings = []
+    errors = []
+
+    async def one(i):
+        member = random.choice(members)
+        form = {'From': member['phone'], 'Body': random.choice(['yes', 'no', 'yes 1', 'L']),
+                'MessageSid': 'SM{:032x}'.format(random.getrandbits(128))}
+        async with limit:
+            started = time.perf_counter()
+            try:
+                status = await post(port, form)
+                if status != 200:
+                    errors.append(status)
+            except OSError as e:
+                errors.append(str(e))
+            timings.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(requests)])
+    return time.perf_counter() - started, sorted(timings), errors
+
+
+def run_mode(mode, args, tmp):
+    members = synthetic_members(args.members)
+    db_file = os.path.join(tmp, '{}.db'.format(mode))
+    write_db(db_file, args.backend, members, [{'name': members[0]['name']}], [])
+    port = free_port()
+    code = BOOT.format(paths=[os.getcwd(), ROOT], db_file=db_file, backend=args.backend,
+                       outbox_file=os.path.join(tmp, '{}-outbox.db'.format(mode)) if args.outbox else None,
+                       dedupe_file=os.path.join(tmp, '{}-dedupe.db'.format(mode)),
+                       send_latency=args.send_latency) + SERVE[mode].format(port=port)
+    server = subprocess.Popen([sys.executable, '-c', code], cwd=tmp, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    try:
+        if not wait_for(port):
+            print('{} server did not start'.format(mode))
+            return
+        elapsed, timings, errors = asyncio.run(burst(port, members, args.requests, args.concurrency))
+    finally:
+        server.terminate()
+        server.wait()
+
+    def ms(p):
+        return timings[min(len(timings) - 1, int(p / 100.0 * len(timings)))] * 1000
+    print('{:>6} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>7}'.format(mode, args.requests / elapsed, ms(50), ms(95),
+                                                                  ms(99), len(errors)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=300)
+    parser.add_argument('--members', type=int, default=300)
+    parser.add_argument('--backend', default='sqlite')
+    parser.add_argument('--modes', default='flask,asgi')
+    parser.add_argument('--send-latency', type=float, default=0.2, help='seconds per stubbed Twilio call')
+    parser.add_argument('--outbox', action='store_true', help='queue outgoing SMS instead of sending inline')
+    args = parser.parse_args()
+
+    print('{:>6} {:>9} {:>9} {:>9} {:>9} {:>7}'.format('mode', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in args.modes.split(','):
+            run_mode(mode, args, tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+###
+# Per-message cost of parsing and dispatching a command in app.main, handlers stubbed out
+#
+# python benchmarks/parse.py [--messages 200000] [--members 150]
+#
+# "regex chain" is the parsing app.main did before commands.py: a regex for the first letter, another
+# for admin symbols, a third inside update_rsvp (or for the 'L' page), and the admin lookup first.
+##
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import app
+import commands
+import config
+import store
+from storage import synthetic_members
+
+MESSAGES = [
+    (30, lambda: 'yes'), (15, lambda: random.choice(['no', 'n', 'No'])),
+    (10, lambda: 'yes {}'.format(random.randint(1, 3))), (30, lambda: random.choice(['L', 'L 2'])),
+    (10, lambda: random.choice(['running late', 'who has the key?'])),
+    (3, lambda: '?'), (2, lambda: '! fees due'),
+]
+
+
+def stub(*args):
+    return args
+
+
+def regex_chain(phone, message):
+    # the old app.main, minus the handlers
+    db = store.get_store()
+    result = re.search('^[a-zA-Z]', message)
+    if result:
+        command = result.group(0).lower()
+        if command in ['y', 'n', 'yes', 'no']:
+            db.get_member(phone)
+            parsed = re.search(r"^([a-zA-Z]*)\s?(\d)?", message)
+            return stub('rsvp', parsed.group(1).lower(), parsed.group(2))
+        elif command in ['l']:
+            return stub('list', int(re.search(r'^[a-zA-Z]*\s*(\d*)', message).group(1) or 1))
+        return stub('forward', db.get_member(phone)['name'], message)
+    if db.is_admin(phone):
+        result = re.search(r'^([?!#])\s?(.*)', message)
+        if result:
+            return stub('admin' + result.group(1), result.group(2))
+    return None
+
+
+def compiled(phone, message):
+    # app.main's parse and table lookup, minus the handlers
+    command = commands.parse(phone, message)
+    if command.word is not None:
+        kind, handler = app.member_commands.get(command.key, ('forward', None))
+        if kind == 'rsvp':
+            return stub(kind, command.member, command.word.lower(), command.digit)
+        if kind == 'list':
+            return stub(kind, command.number or 1)
+        return stub(kind, command.member['name'], command.text)
+    if command.symbol in app.admin_commands and command.is_admin:
+        return stub(app.admin_commands[command.symbol][0], command.rest)
+    return None
+
+
+def run(parse, traffic):
+    started = time.perf_counter()
+    for phone, message in traffic:
+        parse(phone, message)
+    return (time.perf_counter() - started) / len(traffic)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--members', type=int, default=150)
+    args = parser.parse_args()
+
+    members = synthetic_members(args.members)
+    with tempfile.TemporaryDirectory() as tmp:
+        config.db_file = os.path.join(tmp, 'parse.db')
+        db = store.get_store()
+        db.add_members(members)
+        db.add_admins([{'name': members[0]['name']}])
+        weights = [w for w, _ in MESSAGES]
+        traffic = []
+        for _ in range(args.messages):
+            body = random.choices([m for _, m in MESSAGES], weights)[0]()
+            member = members[0] if body[0] in '?!' else random.choice(members)
+            traffic.append((member['phone'], body))
+
+        print('{:>12} {:>12}'.format('parser', 'us/message'))
+        for name, parse in [('regex chain', regex_chain), ('compiled', compiled)]:
+            run(parse, traffic[:1000])  # warm up
+            print('{:>12} {:>12.2f}'.format(name, run(parse, traffic) * 1e6))
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
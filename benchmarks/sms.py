@@ -0,0 +1,74 @@
+###
+# Cold import time of app, and per-message send latency with and without the pooled Twilio client
+#
+# python benchmarks/sms.py [--sends 200] [--latency 0.005]
+#
+# Sends go to the fake Twilio endpoint in benchmarks/fake_twilio.py, through the real twilio client.
+##
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+import sms
+from fake_twilio import FakeTwilio, start_server
+
+COLD_IMPORT = 'import time; t = time.perf_counter(); {} ; print(time.perf_counter() - t)'
+
+
+def cold_import(statement, runs):
+    # fresh interpreter each time so nothing is cached in sys.modules
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.getcwd(), ROOT, os.environ.get('PYTHONPATH', '')]))
+    timings = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', COLD_IMPORT.format(statement)], env=env)
+        timings.append(float(output.decode().strip().splitlines()[-1]))
+    return sorted(timings)[len(timings) // 2]
+
+
+def send_latency(client, sends):
+    timings = []
+    for i in range(sends):
+        started = time.perf_counter()
+        client.messages.create(to='+15555550000', from_=sms.DID_from, body='benchmark {}'.format(i))
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings[len(timings) // 2], sum(timings) / len(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sends', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.005, help='fake API processing time in seconds')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    lazy = cold_import('import app', args.runs)
+    eager = cold_import("import app; from twilio.rest import Client; Client('ACxxx', 'xxx')", args.runs)
+    print('cold import of app: {:.1f} ms lazy client, {:.1f} ms with client built at import'.format(
+        lazy * 1000, eager * 1000))
+
+    FakeTwilio.latency = args.latency
+    server = start_server()
+    sms.API_URL = 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+    from twilio.http.http_client import TwilioHttpClient
+    from twilio.rest import Client
+    unpooled = Client(sms.account_sid, sms.auth_token, http_client=TwilioHttpClient(pool_connections=False))
+    unpooled.api.base_url = sms.API_URL
+    pooled = sms.get_client()
+
+    print('{:>10} {:>10} {:>10}'.format('client', 'p50 ms', 'mean ms'))
+    for name, client in [('new conn', unpooled), ('pooled', pooled)]:
+        send_latency(client, 5)  # warm up
+        p50, mean = send_latency(client, args.sends)
+        print('{:>10} {:>10.2f} {:>10.2f}'.format(name, p50 * 1000, mean * 1000))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
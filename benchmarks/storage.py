@@ -0,0 +1,101 @@
+###
+# Per-reply latency of the TinyDB and SQLite backends as RSVP history grows
+#
+# python benchmarks/storage.py [--sizes 1000,100000,1000000] [--replies 20]
+##
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import store
+
+ROSTER = 150
+WEEK = 7 * 24 * 3600
+
+
+def synthetic_members(count):
+    return [{'name': 'Member{}'.format(i), 'phone': '+1555{:07d}'.format(i)} for i in range(count)]
+
+
+def synthetic_history(rows, roster=ROSTER, first_game=1500000000):
+    # about two replies per member per weekly game
+    members = synthetic_members(roster)
+    rsvps = []
+    for i in range(rows):
+        game = first_game + (i // (roster * 2)) * WEEK
+        rsvps.append({'name': members[random.randrange(roster)]['name'], 'game': game,
+                      'reply': random.choice(['yes', 'no']), 'sub': random.choice([None, None, None, '1']),
+                      'timestamp': game - random.randrange(3 * 24 * 3600)})
+    return members, rsvps
+
+
+def write_tinydb(path, members, admins, rsvps):
+    # written directly, building a big file through TinyDB itself would take hours
+    tables = {'Member': dict((str(i + 1), m) for i, m in enumerate(members)),
+              'Admin': dict((str(i + 1), a) for i, a in enumerate(admins)),
+              'RSVP': dict((str(i + 1), r) for i, r in enumerate(rsvps))}
+    with open(path, 'w') as f:
+        json.dump(tables, f)
+
+
+def write_sqlite(path, members, admins, rsvps):
+    backend = store.SQLiteBackend(path)
+    backend.insert_members(members)
+    backend.insert_admins(admins)
+    backend.insert_rsvps(rsvps)
+    backend.conn.close()
+
+
+def write_db(path, backend, members, admins, rsvps):
+    if backend == 'tinydb':
+        write_tinydb(path, members, admins, rsvps)
+    else:
+        write_sqlite(path, members, admins, rsvps)
+
+
+def replay(db_file, backend, replies):
+    started = time.perf_counter()
+    db = store.Store(db_file, backend=backend)
+    load = time.perf_counter() - started
+    game = max(db.latest)
+    members = db.get_members()
+    timings = []
+    for i in range(replies):
+        member = random.choice(members)
+        started = time.perf_counter()
+        # what set_rsvp does: look up the previous reply, then append the new one
+        db.get_rsvp(game, member['name'])
+        db.insert_rsvp({'name': member['name'], 'game': game, 'reply': random.choice(['yes', 'no']),
+                        'sub': None, 'timestamp': int(time.time()) + i})
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return load, timings[len(timings) // 2], timings[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,100000,1000000')
+    parser.add_argument('--replies', type=int, default=20)
+    parser.add_argument('--backends', default='tinydb,sqlite')
+    args = parser.parse_args()
+
+    print('{:>9} {:>8} {:>10} {:>14} {:>14}'.format('rows', 'backend', 'load s', 'p50 reply ms', 'max reply ms'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in [int(_) for _ in args.sizes.split(',')]:
+            members, rsvps = synthetic_history(rows)
+            for backend in args.backends.split(','):
+                path = os.path.join(tmp, '{}-{}.db'.format(backend, rows))
+                write_db(path, backend, members, [{'name': members[0]['name']}], rsvps)
+                load, p50, worst = replay(path, backend, args.replies)
+                print('{:>9} {:>8} {:>10.2f} {:>14.2f} {:>14.2f}'.format(rows, backend, load, p50 * 1000,
+                                                                         worst * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+###
+# Replay synthetic SMS traffic through the /dweb/ webhook and report latency per command type
+#
+# python benchmarks/webhook.py [--members 150] [--admins 3] [--seasons 5] [--requests 2000]
+#                              [--backend tinydb] [--out webhook-results.json]
+#
+# Outbound SMS are stubbed out, so this measures our own work: parsing, storage and rendering.
+##
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import config
+import dedupe
+import fanout
+import outbox
+import sms
+import store
+from storage import WEEK, synthetic_history, write_db
+
+WEEKS_PER_SEASON = 40
+
+# (command type, share of traffic, body, sent by an admin)
+TRAFFIC = [
+    ('yes', 30, lambda: 'yes', False),
+    ('no', 15, lambda: random.choice(['no', 'n', 'No']), False),
+    ('yes_subs', 10, lambda: 'yes {}'.format(random.randint(1, 3)), False),
+    ('list', 30, lambda: 'L', False),
+    ('free_text', 10, lambda: random.choice(['running late', 'who has the key?', 'can I bring my brother']), False),
+    ('admin_reminder', 3, lambda: '?', True),
+    ('admin_broadcast', 2, lambda: '! Fees are due this week', True),
+]
+
+
+def percentile(ordered, p):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+def build_db(path, backend, members, admins, seasons):
+    games = seasons * WEEKS_PER_SEASON
+    first_game = int(time.time()) - games * WEEK
+    roster, rsvps = synthetic_history(members * 2 * games, roster=members, first_game=first_game)
+    write_db(path, backend, roster, [{'name': m['name']} for m in roster[:admins]], rsvps)
+    return roster, len(rsvps)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--members', type=int, default=150)
+    parser.add_argument('--admins', type=int, default=3)
+    parser.add_argument('--seasons', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--backend', default='tinydb', choices=sorted(store.BACKENDS))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', default='webhook-results.json')
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    tmp = tempfile.mkdtemp()
+    db_file = os.path.join(tmp, 'bench.db')
+    roster, history_rows = build_db(db_file, args.backend, args.members, args.admins, args.seasons)
+
+    # point the app at the synthetic database and keep everything in-process
+    config.db_file = db_file
+    config.testing = False
+    store.DB_BACKEND = args.backend
+    outbox.OUTBOX_FILE = None
+    dedupe.DEDUPE_FILE = os.path.join(tmp, 'dedupe.db')
+    fanout.RATE = 0
+    sms.set_transport(lambda DID_to, DID_from, body: None)
+
+    import run
+    client = run.wsgi.test_client()
+    admins = roster[:args.admins]
+    weights = [share for _, share, _, _ in TRAFFIC]
+    timings = dict((name, []) for name, _, _, _ in TRAFFIC)
+
+    errors = []
+    started = time.perf_counter()
+    # app.py prints as it goes, keep that out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(args.requests):
+            name, _, body, from_admin = random.choices(TRAFFIC, weights)[0]
+            member = random.choice(admins if from_admin else roster)
+            sent = time.perf_counter()
+            response = client.post('/dweb/', data={'From': member['phone'], 'Body': body(),
+                                                   'MessageSid': 'SM{:032x}'.format(i)})
+            timings[name].append(time.perf_counter() - sent)
+            if response.status_code != 200:
+                errors.append('{} from {} returned {}'.format(name, member['phone'], response.status_code))
+    elapsed = time.perf_counter() - started
+    for error in errors:
+        print(error)
+
+    results = {
+        'revision': git_revision(),
+        'timestamp': int(time.time()),
+        'backend': args.backend,
+        'members': args.members,
+        'admins': args.admins,
+        'seasons': args.seasons,
+        'history_rows': history_rows,
+        'requests': args.requests,
+        'throughput': args.requests / elapsed,
+        'errors': len(errors),
+        'commands': {},
+    }
+    print('{} members, {} history rows, {} backend: {:.1f} requests/s overall'.format(
+        args.members, history_rows, args.backend, results['throughput']))
+    print('{:>16} {:>7} {:>9} {:>9} {:>9} {:>10}'.format('command', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s'))
+    for name, samples in timings.items():
+        ordered = sorted(samples)
+        stats = {
+            'count': len(ordered),
+            'p50_ms': percentile(ordered, 50) * 1000,
+            'p95_ms': percentile(ordered, 95) * 1000,
+            'p99_ms': percentile(ordered, 99) * 1000,
+            'throughput': len(ordered) / sum(ordered) if ordered else 0.0,
+        }
+        results['commands'][name] = stats
+        print('{:>16} {:>7} {:>9.2f} {:>9.2f} {:>9.2f} {:>10.1f}'.format(name, stats['count'], stats['p50_ms'],
+                                                                        stats['p95_ms'], stats['p99_ms'],
+                                                                        stats['throughput']))
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Saved to {}'.format(args.out))
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+###
+# One database shared by several worker processes
+#
+# With config.db_shared set, each Store serializes its writes across processes with an advisory lock
+# on <db_file>.lock, and publishes them by bumping a generation counter kept in <db_file>.gen, which
+# every worker maps into memory. Checking for other workers' writes is one read of that mapping; a
+# worker only goes back to the database when the counter has moved.
+#
+# Every open Store also holds a shared flock on <db_file>.open, so command line tools that write to
+# the database (archive.py, import.py) can refuse to run under a server that isn't in db_shared mode,
+# whose cached copy of the file would otherwise write back what they changed.
+##
+import mmap
+import os
+import struct
+import threading
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; db_shared needs a POSIX system
+    fcntl = None
+
+import config
+
+SHARED = getattr(config, 'db_shared', False)
+
+_reopen_lock = threading.Lock()
+
+
+class FileLock(object):
+    # exclusive across processes (flock), reentrant within one (threads queue on an RLock first).
+    #  on_acquire runs each time the lock is taken from another process, before the caller carries on
+    def __init__(self, path, on_acquire=None):
+        if fcntl is None:
+            raise RuntimeError('db_shared needs fcntl (a POSIX system)')
+        self.path = path
+        self.pid = os.getpid()
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.rlock = threading.RLock()
+        self.depth = 0
+        self.on_acquire = on_acquire
+
+    def reopen(self):
+        # in a worker forked after the lock was opened (gunicorn --preload): the inherited descriptor
+        #  shares the parent's open file, so flock wouldn't keep the two apart
+        with _reopen_lock:
+            if self.pid != os.getpid():
+                os.close(self.fd)
+                self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                self.rlock = threading.RLock()
+                self.depth = 0
+                self.pid = os.getpid()
+
+    def acquire(self):
+        if self.pid != os.getpid():
+            self.reopen()
+        self.rlock.acquire()
+        self.depth += 1
+        if self.depth == 1:
+            try:
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+                if self.on_acquire is not None:
+                    self.on_acquire()
+            except Exception:
+                self.release()
+                raise
+        return True
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.rlock.release()
+
+    def close(self):
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class Generation(object):
+    # (writes, reloads) counters in a small file mapped into every worker's memory. Every write bumps
+    #  writes; one the other workers can't catch up with incrementally (members, admins, deletes) bumps
+    #  reloads as well
+    FORMAT = '<QQ'
+
+    def __init__(self, path):
+        self.path = path
+        size = struct.calcsize(self.FORMAT)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                # only ever grows the file, so a second worker starting up can't zero the counters
+                os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def read(self):
+        return struct.unpack_from(self.FORMAT, self.map)
+
+    def bump(self, reload=False):
+        # the caller holds the FileLock; returns the new counters
+        writes, reloads = self.read()
+        new = (writes + 1, reloads + int(reload))
+        struct.pack_into(self.FORMAT, self.map, 0, *new)
+        return new
+
+    def close(self):
+        self.map.close()
+
+
+def hold_open(db_file):
+    # for as long as the returned file stays open, in_use(db_file) is True in other processes
+    if fcntl is None:
+        return None
+    marker = open(db_file + '.open', 'a')
+    fcntl.flock(marker.fileno(), fcntl.LOCK_SH)
+    return marker
+
+
+def in_use(db_file):
+    # True if a Store has db_file open (in this or another process)
+    if fcntl is None:
+        return False
+    with open(db_file + '.open', 'a') as marker:
+        try:
+            fcntl.flock(marker.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(marker.fileno(), fcntl.LOCK_UN)
+    return False
+
+
+def check_offline(db_file):
+    # for tools that write to the database: exits if a server without db_shared has it open
+    if not SHARED and in_use(db_file):
+        raise SystemExit('{} is open in a running server. Stop it first, or run both with db_shared = True'
+                         .format(db_file))
@@ -0,0 +1,61 @@
+###
+# Incoming SMS parsed once into a Command for app.main's command tables
+#
+# One precompiled pattern splits a message into its leading word (member commands: 'yes 2', 'L 3')
+# or leading symbol (admin commands: '? ', '! fees due'), and the rest. The sender's member record
+# and admin flag are looked up at most once per message, and only if a handler asks for them.
+##
+import re
+
+import store
+
+# word or symbol, one optional space, then the rest of the first line
+TOKENS = re.compile(r'(?:([a-zA-Z]+)|([^\w\s]))\s?(.*)')
+NUMBER = re.compile(r'\s*(\d+)')
+
+
+class Command(object):
+    __slots__ = ('phone', 'text', 'word', 'symbol', 'rest', '_member', '_admin')
+
+    def __init__(self, phone, text, word=None, symbol=None, rest=''):
+        self.phone = phone
+        self.text = text  # the whole message
+        self.word = word  # leading letters as sent, e.g. 'Yes'
+        self.symbol = symbol  # leading symbol, e.g. '!'
+        self.rest = rest  # what follows the word or symbol (and one space)
+        self._member = self._admin = None
+
+    @property
+    def key(self):
+        # what the command tables are keyed on: the word's first letter, lower case, or the symbol
+        return self.word[0].lower() if self.word else self.symbol
+
+    @property
+    def digit(self):
+        # the single digit right after the word ('yes 2'), or None
+        return self.rest[:1] if self.rest[:1].isdecimal() else None
+
+    @property
+    def number(self):
+        # the whole number after the word ('L 12'), or None
+        digits = NUMBER.match(self.rest)
+        return int(digits.group(1)) if digits else None
+
+    @property
+    def member(self):
+        if self._member is None:
+            self._member = store.get_store().get_member(self.phone) or False
+        return self._member or None
+
+    @property
+    def is_admin(self):
+        if self._admin is None:
+            self._admin = store.get_store().is_admin(self.phone)
+        return self._admin
+
+
+def parse(phone, message):
+    match = TOKENS.match(message)
+    if match is None:
+        return Command(phone, message)
+    return Command(phone, message, match.group(1), match.group(2), match.group(3))
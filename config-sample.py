@@ -16,12 +16,73 @@ else:
     admin_members = [{'name': 'Testman'}]
     db_file = 'dev.db'
 
-event_weekday = 3  # day of the week (0 is Monday)
+db_backend = 'tinydb'  # or 'sqlite', after converting db_file with migrate.py
+rsvp_flush_ms = 0  # buffer RSVP writes for up to this long during reply bursts, 0 to write each reply
+rsvp_flush_rows = 50  # ... or until this many replies are waiting
+db_shared = False  # True when several worker processes serve the same db_file (no write-behind then)
+
+event_weekday = 3  # day of the week, isoweekday() style (1 is Monday, 7 or 0 is Sunday)
 event_hour = 19  # military (24 hr)
 event_minute = 30
+# more than one game a week: [(weekday, hour, minute), ...] replaces the three settings above
+event_slots = []
+skip_dates = []  # 'YYYY-MM-DD' dates with no game (holidays, gym closed)
+extra_games = []  # one-off games, 'YYYY-MM-DD HH:mm'
+event_timezone = 'local'
+game_capacity = 0  # players per game (members plus subs), extra 'yes' replies go on STANDBY. 0 for no limit
+status_layout = 'full'  # 'L' reply: 'full' for a line per member, 'compact' for names grouped by reply
+status_page_segments = 0  # split the 'L' reply into pages of this many SMS segments ('L 2' for page 2). 0 for one page
 test_caller_id = '+15555555555'
+journal_compact_every = 50  # replies appended to a game's journal (by any process) before it is compacted into the CSV
+
+# for archive.py: past seasons (calendar years) of RSVPs moved to compressed, read-only files
+archive_dir = None  # None for '<db_file name>-archive' next to the database
+archive_keep_seasons = 0  # seasons kept in the database (this one included), archived at startup. 0 to never archive
+
+# for analytics.py ('#' admin command)
+flake_hours = 24  # a 'yes' changed to 'no' within this many hours of the game counts as a late flake
+
+# for digest.py: batch admin notifications, sent every admin_digest_seconds or admin_digest_events. 0 sends each one
+admin_digest_seconds = 0  # e.g. 600
+admin_digest_events = 20
+
+# for groups.py: many groups behind one webhook, each with its own number, database and schedule.
+#  Routed by /dweb/<name>/ or by the number texted; settings a group leaves out come from this file
+groups = {}  # e.g. {'tuesday': {'phone': '+15555550100', 'db_file': 'tuesday.db', 'event_weekday': 2,
+#                              'member_list': [...], 'admin_members': [...]}}
+groups_max_open = 50  # groups kept loaded in memory, least recently used are closed first
+
+# for scheduler.py: polls and reminders sent by the running server, (job, seconds before the game)
+reminder_offsets = []  # e.g. [('poll', 3 * 24 * 3600), ('reminder', 24 * 3600), ('reminder', 3 * 3600)]
+scheduler_file = 'scheduler.json'
 
 # for sms.py
 account_sid = "xxx"
 auth_token = "xxx"
 DID_from = "+15555555555"
+sms_pool_size = 10  # keep-alive connections kept open to the Twilio API
+sms_api_url = None  # base URL of a Twilio compatible stand-in, None for api.twilio.com
+sms_transport = None  # 'module.function(DID_to, DID_from, body)' to replace Twilio, e.g. 'sms.console_transport'
+
+# for fanout.py
+sms_rate = 1  # messages per second allowed on the account, 0 for no limit
+sms_workers = 4  # concurrent Twilio API requests
+sms_retries = 3  # retries on 429/5xx responses
+sms_backoff = 0.5  # seconds before the first retry, doubled each time
+
+# for outbox.py
+outbox_file = 'outbox.db'  # persistent queue for outgoing messages, None to send inline
+outbox_max_attempts = 5
+
+# for dedupe.py
+dedupe_file = 'dedupe.db'  # replies remembered by MessageSid so Twilio retries aren't handled twice
+dedupe_ttl = 24 * 3600  # seconds
+dedupe_max = 10000  # replies kept
+
+# for asgi.py (uvicorn asgi:app)
+asgi_threads = 32  # threads running app.main and the store behind the event loop
+asgi_port = 6543
+
+# for metrics.py
+metrics_enabled = False  # counters and latency histograms on /metrics
+timing_log = False  # print a timing line for every webhook request
@@ -0,0 +1,121 @@
+###
+# Twilio retries a webhook when we are slow to answer. Remember the TwiML sent for each MessageSid
+# so a retry gets the same answer without running app.main (and its RSVP writes and SMS) again.
+##
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import config
+import metrics
+
+DEDUPE_FILE = getattr(config, 'dedupe_file', None)  # None disables deduplication
+TTL = getattr(config, 'dedupe_ttl', 24 * 3600)  # seconds a MessageSid is remembered
+MAX_ENTRIES = getattr(config, 'dedupe_max', 10000)
+WAIT = 10  # seconds a retry waits for the original request to finish
+
+
+class ReplyCache(object):
+    def __init__(self, path, ttl=TTL, max_entries=MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.replies = OrderedDict()  # sid -> (created, response), oldest first
+        self.pending = {}  # sid -> Event, for requests still being handled
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS reply (sid TEXT PRIMARY KEY, created REAL NOT NULL, '
+                              'response TEXT NOT NULL)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS reply_created ON reply (created)')
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            self.conn.execute('DELETE FROM reply WHERE created <= ?', (time.time() - ttl,))
+        # what survived the restart, newest max_entries only
+        rows = self.conn.execute('SELECT sid, created, response FROM reply WHERE created > ? '
+                                 'ORDER BY created DESC LIMIT ?', (time.time() - ttl, max_entries)).fetchall()
+        for sid, created, response in reversed(rows):
+            self.replies[sid] = (created, response)
+
+    def _evict(self, now):
+        # oldest first, so stop at the first entry that is still fresh and within bounds
+        expired = []
+        while self.replies:
+            sid, (created, _) = next(iter(self.replies.items()))
+            if created > now - self.ttl and len(self.replies) <= self.max_entries:
+                break
+            self.replies.popitem(last=False)
+            expired.append((sid,))
+        return expired
+
+    def get(self, sid):
+        with self.lock:
+            entry = self.replies.get(sid)
+            if entry is not None and entry[0] > time.time() - self.ttl:
+                return entry[1]
+        return None
+
+    def begin(self, sid):
+        # returns (cached response or None, True if the caller should handle the message)
+        with self.lock:
+            entry = self.replies.get(sid)
+            if entry is None:
+                # answered by another worker process sharing the file?
+                entry = self.conn.execute('SELECT created, response FROM reply WHERE sid = ?', (sid,)).fetchone()
+                if entry is not None:
+                    self.replies[sid] = entry = tuple(entry)
+            if entry is not None and entry[0] > time.time() - self.ttl:
+                return entry[1], False
+            event = self.pending.get(sid)
+            if event is None:
+                self.pending[sid] = threading.Event()
+                return None, True
+        # a retry that arrived while the original is still running
+        event.wait(WAIT)
+        return self.get(sid), False
+
+    def finish(self, sid, response):
+        now = time.time()
+        with self.lock:
+            event = self.pending.pop(sid, None)
+            if response is not None:
+                self.replies[sid] = (now, response)
+                expired = self._evict(now)
+                with self.conn:
+                    self.conn.execute('INSERT OR REPLACE INTO reply VALUES (?, ?, ?)', (sid, now, response))
+                    if expired:
+                        self.conn.executemany('DELETE FROM reply WHERE sid = ?', expired)
+        if event is not None:
+            event.set()
+
+
+def run_once(sid, handler):
+    # handler() builds the response; for a MessageSid seen before, the stored response is returned instead
+    cache = get_cache()
+    if cache is None or not sid:
+        return handler()
+    response, first = cache.begin(sid)
+    if not first:
+        metrics.inc('webhook_retries_total')
+        return response if response is not None else ''
+    response = None
+    try:
+        response = handler()
+    finally:
+        # on an exception nothing is stored, so Twilio's retry gets a fresh attempt
+        cache.finish(sid, response)
+    return response
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    if DEDUPE_FILE is None:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ReplyCache(DEDUPE_FILE)
+    return _cache
@@ -0,0 +1,86 @@
+###
+# 4.1 Admin digest: batch admin notifications into one message per admin
+#
+# With config.admin_digest_seconds set, notify_admin buffers its messages and sends them together
+# when the window ends or when admin_digest_events have been buffered, whichever comes first.
+# A newer message with the same key (e.g. the same member changing their RSVP again) replaces the
+# older one. Urgent messages skip the buffer and go out straight away.
+##
+import atexit
+import threading
+
+import config
+import metrics
+
+WINDOW = getattr(config, 'admin_digest_seconds', 0)  # 0 sends every notification as it happens
+MAX_EVENTS = getattr(config, 'admin_digest_events', 20)
+MAX_LENGTH = 1600  # longest message Twilio accepts; longer digests are sent in parts
+
+
+class Digest(object):
+    def __init__(self, send, window=WINDOW, max_events=MAX_EVENTS):
+        self.send = send  # called with each combined message
+        self.window = window
+        self.max_events = max_events
+        self.lock = threading.RLock()
+        self.pending = []  # (key, message), oldest first
+        self.timer = None
+        if window:
+            atexit.register(self.flush)
+
+    def add(self, message, urgent=False, key=None):
+        if urgent or not self.window:
+            self.send(message)
+            return
+        with self.lock:
+            if key is not None:
+                self.pending = [item for item in self.pending if item[0] != key]
+            self.pending.append((key, message))
+            if len(self.pending) >= self.max_events:
+                self.flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.window, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        # send everything buffered; returns how many notifications went out
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            messages = [message for _, message in self.pending]
+            self.pending = []
+        if not messages:
+            return 0
+        metrics.inc('admin_digests_total')
+        for part in combine(messages):
+            self.send(part)
+        return len(messages)
+
+
+def combine(messages):
+    # one message per MAX_LENGTH characters, never splitting a notification
+    if len(messages) == 1:
+        return messages
+    parts = []
+    part = '{} updates:'.format(len(messages))
+    for message in messages:
+        if len(part) + 1 + len(message) > MAX_LENGTH:
+            parts.append(part)
+            part = message
+        else:
+            part = part + '\n' + message
+    parts.append(part)
+    return parts
+
+
+_digests = {}  # group name (None without config.groups) -> Digest
+_digest_lock = threading.Lock()
+
+
+def get_digest(send, group=None):
+    with _digest_lock:
+        if group not in _digests:
+            _digests[group] = Digest(send)
+    return _digests[group]
@@ -0,0 +1,84 @@
+###
+# Concurrent, rate limited SMS fan-out
+##
+import contextvars
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+# Twilio long codes are limited to 1 message per second unless the account says otherwise
+RATE = getattr(config, 'sms_rate', 1)  # messages per second, 0 for no limit
+WORKERS = getattr(config, 'sms_workers', 4)
+RETRIES = getattr(config, 'sms_retries', 3)
+BACKOFF = getattr(config, 'sms_backoff', 0.5)  # seconds, doubled on every retry
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        # block until a token is available
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_retryable(error):
+    # TwilioRestException (and most HTTP errors) carry the response status
+    status = getattr(error, 'status', None)
+    return status == 429 or (status is not None and status >= 500)
+
+
+def send_with_retry(send, bucket, member, body, retries=RETRIES, backoff=BACKOFF):
+    result = {'name': member.get('name'), 'phone': member['phone'], 'status': 'sent', 'attempts': 0, 'error': None}
+    while True:
+        bucket.take()
+        result['attempts'] += 1
+        try:
+            send(member, body)
+            return result
+        except Exception as e:
+            if result['attempts'] > retries or not is_retryable(e):
+                result['status'] = 'failed'
+                result['error'] = str(e)
+                return result
+            # exponential backoff with a little jitter so workers don't retry in lockstep
+            time.sleep(backoff * 2 ** (result['attempts'] - 1) * random.uniform(1, 1.5))
+
+
+def dispatch(jobs, send, rate=None, workers=None, retries=RETRIES, backoff=BACKOFF):
+    # jobs: list of (member, body) pairs, send: callable(member, body)
+    # returns a delivery summary with one result per recipient, in job order
+    jobs = list(jobs)
+    bucket = TokenBucket(RATE if rate is None else rate)
+    workers = max(1, min(WORKERS if workers is None else workers, len(jobs)))
+    started = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # each job runs in a copy of the caller's context, so it sends for the caller's group
+            futures = [pool.submit(contextvars.copy_context().run, send_with_retry, send, bucket, member, body,
+                                   retries, backoff) for member, body in jobs]
+            results = [f.result() for f in futures]
+    except RuntimeError:
+        # the interpreter is exiting (e.g. a flush from atexit) and won't start threads: send one at a time
+        results = [send_with_retry(send, bucket, member, body, retries, backoff) for member, body in jobs]
+    sent = len([r for r in results if r['status'] == 'sent'])
+    return {'sent': sent, 'failed': len(results) - sent, 'results': results,
+            'seconds': time.monotonic() - started}
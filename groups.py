@@ -0,0 +1,186 @@
+###
+# Many pickup groups behind one webhook
+#
+# config.groups maps a group name to its own settings, e.g.
+#   groups = {'tuesday': {'phone': '+15555550100', 'db_file': 'tuesday.db', 'event_weekday': 2,
+#                         'member_list': [...], 'admin_members': [...]}}
+# Anything a group leaves out comes from config. A reply is routed to its group by the URL
+# (/dweb/<group>/) or else by the Twilio number it was sent to (To). While it is handled that group
+# is "current": store.get_store(), schedule.get_schedule() and the sending number all follow it.
+# Only the groups_max_open most recently used groups keep their store in memory, and a group is never
+# closed while a request, timer or scheduled job is using it. Schedules are cheap and kept for all.
+##
+import contextvars
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import archive
+import config
+import schedule
+import store
+
+GROUPS = getattr(config, 'groups', {})  # empty: the single group set up in config
+MAX_OPEN = getattr(config, 'groups_max_open', 50)
+
+_current = contextvars.ContextVar('group', default=None)
+
+
+class Settings(object):
+    # a group's settings, falling back to config for anything it doesn't set
+    def __init__(self, values):
+        self.values = values
+
+    def __getattr__(self, key):
+        if key in self.values:
+            return self.values[key]
+        return getattr(config, key)
+
+
+class Group(object):
+    def __init__(self, name, values):
+        self.name = name
+        self.settings = Settings(values)
+        self.phone = self.settings.values.get('phone')
+        self.users = 0  # requests, timers and jobs inside use(), under _open_lock
+        self.closed = False
+        self.store = store.Store(self.settings.db_file, getattr(self.settings, 'db_backend', None))
+        if len(self.store.tables()) <= 1:
+            # first use: seed members and admins, as run.init_db does for a single group
+            self.store.add_members(self.settings.member_list)
+            self.store.add_admins(self.settings.admin_members)
+        elif archive.KEEP_SEASONS:
+            archive.archive_seasons(self.store, archive.KEEP_SEASONS)
+        self.schedule = get_schedule(name)
+
+    def close(self):
+        self.store.close()
+
+
+_open = OrderedDict()  # name -> Group, least recently used first
+_open_lock = threading.Lock()
+_loading = {}  # name -> Event, set once a group being loaded is in _open
+_by_phone = dict((values['phone'], name) for name, values in GROUPS.items() if values.get('phone'))
+_schedules = {}  # name -> Schedule, for every group, loaded or not
+_schedules_lock = threading.Lock()
+
+
+def get_schedule(name):
+    # a group's schedule without loading its store (all the scheduler needs)
+    with _schedules_lock:
+        games = _schedules.get(name)
+        if games is None:
+            s = Settings(GROUPS[name])
+            games = _schedules[name] = schedule.Schedule(schedule.weekly_slots(s), getattr(s, 'skip_dates', ()),
+                                                         getattr(s, 'extra_games', ()),
+                                                         getattr(s, 'event_timezone', 'local'))
+    return games
+
+
+def _evict(keep=None):
+    # under _open_lock: drop the least recently used groups nobody is using, over MAX_OPEN (but not
+    #  `keep`, just loaded). Returns them, to be closed once the lock is released
+    idle = [group for group in _open.values() if not group.users and group.name != keep]
+    evicted = []
+    while len(_open) > MAX_OPEN and idle:
+        group = idle.pop(0)
+        del _open[group.name]
+        group.closed = True
+        evicted.append(group)
+    return evicted
+
+
+def get_group(name):
+    # the loaded group, loading it (and closing least recently used ones) if needed. A group is loaded
+    #  outside the lock so other groups' requests carry on meanwhile; requests for it wait
+    while True:
+        with _open_lock:
+            group = _open.get(name)
+            if group is not None:
+                _open.move_to_end(name)
+                return group
+            loading = _loading.get(name)
+            if loading is None:
+                loading = _loading[name] = threading.Event()
+                break
+        loading.wait()
+    group = None
+    evicted = []
+    try:
+        group = Group(name, GROUPS[name])
+    finally:
+        with _open_lock:
+            del _loading[name]
+            if group is not None:
+                _open[name] = group
+                evicted = _evict(keep=name)
+        loading.set()
+    for old in evicted:
+        old.close()
+    return group
+
+
+def route(name=None, to=None):
+    # the group for a webhook request: by name (URL) first, then by the number it was sent to.
+    #  None if nothing matches
+    if name is None:
+        name = _by_phone.get(to)
+    if name not in GROUPS:
+        return None
+    return get_group(name)
+
+
+def current():
+    return _current.get()
+
+
+def hold(group):
+    # count a user of the group, so it isn't closed meanwhile. If it was closed already, the group is
+    #  loaded again and that one is used instead
+    while True:
+        with _open_lock:
+            if not group.closed:
+                group.users += 1
+                return group
+        group = get_group(group.name)
+
+
+def release(group):
+    with _open_lock:
+        group.users -= 1
+        evicted = _evict()
+    for old in evicted:
+        old.close()
+
+
+@contextmanager
+def use(group):
+    if group is not None:
+        group = hold(group)
+    token = _current.set(group)
+    try:
+        yield group
+    finally:
+        _current.reset(token)
+        if group is not None:
+            release(group)
+
+
+def bind(func):
+    # func, set to run in the group that is current now (for timers and other threads). The group is
+    #  looked up again on each call, in case it has been closed and reloaded since
+    group = current()
+    name = group.name if group is not None else None
+
+    def run(*args, **kwargs):
+        with use(get_group(name) if name is not None else None):
+            return func(*args, **kwargs)
+    return run
+
+
+def close_all():
+    with _open_lock:
+        while _open:
+            group = _open.popitem(last=False)[1]
+            group.closed = True
+            group.close()
@@ -1,36 +1,83 @@
 ###
 # Import RSVP history from previous games via CSV files
+#
+# python import.py             - every ./rsvps/<game_date>.csv
+# python import.py 2017-09-07  - just ./rsvps/2017-09-07.csv
+#
+# Refuses to run while a server has the database open, unless both run with db_shared
 ##
+import csv
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import app
+import coherence
+import config
+import journal
+import store
+
+RSVP_DIR = './rsvps'
+
+
+def parse_file(path):
+    # stream one game file: returns (game_date, {name: reply}), last line per player wins
+    game_date = os.path.splitext(os.path.basename(path))[0]
+    replies = {}
+    with open(path, 'r', newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)  # header
+        for row in reader:
+            if len(row) < 3:
+                continue
+            phone, player, rsvp = [_.strip() for _ in row[:3]]
+            replies[player] = 'yes' if rsvp == 'y' else 'no'
+    return game_date, replies
+
+
+def import_game(db, game_date, replies, imported_at):
+    # straight into the store, so admins aren't notified of history, and in one write per game.
+    #  Players that already have an RSVP for the game are skipped, which makes re-runs a no-op
+    game = app.get_next_game(game_date).timestamp
+    existing = db.get_game_rsvps(game)
+    batch = [{'name': player, 'game': game, 'reply': reply, 'sub': 0, 'timestamp': imported_at}
+             for player, reply in replies.items() if player not in existing]
+    if batch:
+        db.insert_rsvps(batch)
+    return len(batch)
 
 
 def main(game_date=None):
+    # replies program.py hasn't compacted into the CSVs yet
+    journal.compact_dir(RSVP_DIR)
     if game_date is None:
         # process files in ./rsvps/ dir
-        pass
+        files = sorted(glob.glob(os.path.join(RSVP_DIR, '*.csv')))
     else:
-        game_datetime = app.get_next_game(game_date)
         # look for <game_date>.csv file in ./rsvps/
-        with open('./rsvps/{}.csv'.format(game_date), 'r') as f:
-            history = f.readlines()
+        files = [os.path.join(RSVP_DIR, '{}.csv'.format(game_date))]
 
-        for response in history[1:]:
-            phone, player, rsvp = response.strip().split(',')
-            if rsvp == 'y':
-                rsvp = 'yes'
-            else:
-                rsvp = 'no'
-            member = {'name': player, 'phone': phone}
-            app.set_rsvp(game_datetime,  member, rsvp, 0)
-            # print('{} said {} to game'.format(player, rsvp))
+    coherence.check_offline(config.db_file)
+    started = time.time()
+    db = store.get_store()
+    parsed = rows = imported = 0
+    with ProcessPoolExecutor() as pool:
+        for file_date, replies in pool.map(parse_file, files):
+            parsed += 1
+            rows += len(replies)
+            imported += import_game(db, file_date, replies, int(started))
+    db.flush()
+    elapsed = max(time.time() - started, 1e-6)
+    print('Imported {} of {} RSVPs from {} files in {:.2f}s ({:.0f} rows/s)'.format(imported, rows, parsed, elapsed,
+                                                                                   rows / elapsed))
 
 
 if __name__ == '__main__':
-    game_date = '2017-09-07'
+    game_date = sys.argv[1] if len(sys.argv) > 1 else None
     print('### updating db ###')
     main(game_date)
-    print('### results ###')
-    print(app.send_rsvp_status(app.get_next_game(game_date)))
-    # print(app.config.testing)
-
-    pass
+    if game_date is not None:
+        print('### results ###')
+        print(app.send_rsvp_status(app.get_next_game(game_date)))
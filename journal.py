@@ -0,0 +1,218 @@
+###
+# Append-only RSVP journal for the CSV engine in program.py
+#
+# Each reply is one line appended (and fsync'd) to rsvps/<game_date>.journal instead of rewriting the
+# whole <game_date>.csv. The latest reply per phone is kept in memory, rebuilt from the CSV plus a
+# replay of the journal. Compaction writes that state back into the CSV and empties the journal.
+#
+# Several processes can share a game's files (program.py runs once per command): appends and
+# compactions hold an flock on the journal, and each process first reads whatever lines the others
+# added since it last looked, or everything again if one of them compacted in the meantime.
+# Without fcntl (Windows) only threads are kept apart, so run one process at a time there.
+##
+import atexit
+import csv
+import glob
+import io
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+import config
+
+COMPACT_EVERY = getattr(config, 'journal_compact_every', 50)  # journal lines before compacting. 0 never
+FIELDNAMES = ['phone_number', 'name', 'rsvp']
+
+
+def journal_path(csv_path):
+    return os.path.splitext(csv_path)[0] + '.journal'
+
+
+def file_id(path):
+    # changes when compaction renames a new CSV over the old one
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class Journal(object):
+    def __init__(self, csv_path):
+        self.csv_path = csv_path
+        self.path = journal_path(csv_path)
+        self.lock = threading.Lock()
+        self.rows = {}  # phone -> {'name': ..., 'rsvp': ...}, in first-reply order like the CSV
+        self.appended = 0  # lines in the journal since the last compaction, any process's
+        self.offset = 0  # bytes of the journal read into rows
+        self.csv_id = None  # file_id of the CSV rows were read from
+        self.file = open(self.path, 'ab')
+        with self.locked():
+            pass
+
+    @contextmanager
+    def locked(self):
+        # the thread lock, then the flock, then catch up with the other processes
+        with self.lock:
+            if fcntl is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+            try:
+                self.catch_up()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+
+    def catch_up(self):
+        # with the flock held: nobody is part way through a line, so a last line without its newline
+        #  was cut short by a crash
+        csv_id = file_id(self.csv_path)
+        size = os.fstat(self.file.fileno()).st_size
+        if csv_id != self.csv_id or size < self.offset:
+            # compacted by another process (or first use): start again from the CSV
+            self.rows = {}
+            self.appended = self.offset = 0
+            self.csv_id = csv_id
+            if csv_id is not None:
+                with open(self.csv_path, 'r', newline='') as f:
+                    for entry in csv.DictReader(f):
+                        self.rows[entry['phone_number']] = {'name': entry['name'], 'rsvp': entry['rsvp']}
+        if size == self.offset:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        complete = data[:data.rfind(b'\n') + 1]
+        for row in csv.reader(io.StringIO(complete.decode('utf-8'))):
+            if len(row) == 3 and row[2]:
+                self.rows[row[0]] = {'name': row[1], 'rsvp': row[2]}
+                self.appended += 1
+        self.offset += len(complete)
+        if len(complete) < len(data):
+            # end the torn line so the next reply starts on a line of its own; it is skipped as garbage
+            self.write(b'\n')
+            self.offset = size + 1
+
+    def write(self, data):
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def exists(self):
+        with self.locked():
+            return self.csv_id is not None or self.appended > 0
+
+    def get_rows(self):
+        with self.locked():
+            return dict((phone, dict(row)) for phone, row in self.rows.items())
+
+    def append(self, phone, name, rsvp):
+        # O(1): one line and an fsync, whatever the size of the roster (plus any lines other processes
+        #  added). Returns the reply it replaced, or None
+        line = io.StringIO()
+        csv.writer(line).writerow([phone, name, rsvp])
+        data = line.getvalue().encode('utf-8')
+        with self.locked():
+            previous = self.rows.get(phone)
+            self.write(data)
+            self.offset += len(data)
+            self.rows[phone] = {'name': name, 'rsvp': rsvp}
+            self.appended += 1
+            if COMPACT_EVERY and self.appended >= COMPACT_EVERY:
+                self._compact()
+        return previous
+
+    def compact(self):
+        with self.locked():
+            if self.appended or self.csv_id is None:
+                self._compact()
+
+    def _compact(self):
+        # new CSV first (written aside, fsync'd and renamed over the old one), then empty the journal.
+        #  A crash in between only means some lines get replayed onto a CSV that already has them
+        tmp = self.csv_path + '.tmp'
+        with open(tmp, 'w', newline='') as fout:
+            writer = csv.DictWriter(fout, fieldnames=FIELDNAMES)
+            writer.writeheader()
+            for phone, row in self.rows.items():
+                writer.writerow({'phone_number': phone, 'name': row['name'], 'rsvp': row['rsvp']})
+            fout.flush()
+            os.fsync(fout.fileno())
+        os.replace(tmp, self.csv_path)
+        self.file.truncate(0)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.appended = self.offset = 0
+        self.csv_id = file_id(self.csv_path)
+
+    def close(self):
+        # left in the journal: the next process replays it, compaction is up to COMPACT_EVERY
+        with self.lock:
+            self.file.close()
+
+
+def read_rows(csv_path):
+    # {phone: {'name', 'rsvp'}} from a game's CSV plus its journal, read only (reports). A shared
+    #  flock on the journal keeps a compaction from happening part way through
+    rows = {}
+    path = journal_path(csv_path)
+    journal_file = open(path, 'rb') if os.path.isfile(path) else None
+    try:
+        if journal_file is not None and fcntl is not None:
+            fcntl.flock(journal_file.fileno(), fcntl.LOCK_SH)
+        if os.path.isfile(csv_path):
+            with open(csv_path, 'r', newline='') as f:
+                for entry in csv.DictReader(f):
+                    rows[entry['phone_number']] = {'name': entry['name'], 'rsvp': entry['rsvp']}
+        data = journal_file.read() if journal_file is not None else b''
+    finally:
+        if journal_file is not None:
+            journal_file.close()
+    # a line still being written (or torn by a crash) is left out
+    for row in csv.reader(io.StringIO(data[:data.rfind(b'\n') + 1].decode('utf-8'))):
+        if len(row) == 3 and row[2]:
+            rows[row[0]] = {'name': row[1], 'rsvp': row[2]}
+    return rows
+
+
+_journals = {}  # csv path -> Journal
+_journals_lock = threading.Lock()
+
+
+def get_journal(csv_path):
+    with _journals_lock:
+        journal = _journals.get(csv_path)
+        if journal is None:
+            # a new game: fold the previous games' journals into their CSVs
+            for old in list(_journals):
+                previous = _journals.pop(old)
+                previous.compact()
+                previous.close()
+            journal = _journals[csv_path] = Journal(csv_path)
+    return journal
+
+
+def compact_dir(rsvp_dir):
+    # fold any leftover journals into their CSVs (e.g. before reading the CSVs directly)
+    for path in glob.glob(os.path.join(rsvp_dir, '*.journal')):
+        csv_path = os.path.splitext(path)[0] + '.csv'
+        with _journals_lock:
+            journal = _journals.get(csv_path)
+        if journal is not None:
+            journal.compact()
+        elif os.path.getsize(path):
+            journal = Journal(csv_path)
+            journal.compact()
+            journal.close()
+
+
+@atexit.register
+def close_all():
+    with _journals_lock:
+        for csv_path in list(_journals):
+            _journals.pop(csv_path).close()
@@ -0,0 +1,140 @@
+###
+# Counters, latency histograms and timing spans, exposed in the Prometheus text format on /metrics
+#
+# Everything here is a no-op unless config.metrics_enabled (or config.timing_log) is set.
+##
+import threading
+import time
+
+import config
+
+ENABLED = getattr(config, 'metrics_enabled', False)
+TIMING_LOG = getattr(config, 'timing_log', False)  # one line per webhook request with its span timings
+PREFIX = 'rsvp_sms_'
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_counters = {}  # (name, labels) -> count
+_histograms = {}  # (name, labels) -> [count per bucket..., +Inf count, sum]
+_request = threading.local()  # spans seen by the current webhook request, for the timing log
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name, seconds, **labels):
+    if ENABLED:
+        key = _key(name, labels)
+        with _lock:
+            histogram = _histograms.get(key)
+            if histogram is None:
+                histogram = _histograms[key] = [0] * (len(BUCKETS) + 2)
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+    spans = getattr(_request, 'spans', None)
+    if spans is not None:
+        label = labels.get('span', name)
+        spans[label] = spans.get(label, 0.0) + seconds
+
+
+class Span(object):
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe('span_seconds', time.perf_counter() - self.started, span=self.name, **self.labels)
+        return False
+
+
+class NoSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_SPAN = NoSpan()
+
+
+def span(name, **labels):
+    # with metrics.span('db_insert', table='RSVP'): ...
+    if not (ENABLED or TIMING_LOG):
+        return NO_SPAN
+    return Span(name, labels)
+
+
+def start_request():
+    if TIMING_LOG:
+        _request.spans = {}
+        _request.started = time.perf_counter()
+
+
+def end_request(**fields):
+    # the opt-in per-request timing line: total and per-span milliseconds
+    spans = getattr(_request, 'spans', None)
+    if spans is None:
+        return None
+    _request.spans = None
+    parts = ['{}={}'.format(k, v) for k, v in sorted(fields.items())]
+    parts.append('total={:.1f}ms'.format((time.perf_counter() - _request.started) * 1000))
+    parts.extend('{}={:.1f}ms'.format(k, v * 1000) for k, v in sorted(spans.items()))
+    line = 'timing ' + ' '.join(parts)
+    print(line)
+    return line
+
+
+def _labels(labels, extra=()):
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in labels) + '}'
+
+
+def render():
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted(_histograms.items())
+    seen = set()
+    for (name, labels), value in counters:
+        if name not in seen:
+            seen.add(name)
+            lines.append('# TYPE {}{} counter'.format(PREFIX, name))
+        lines.append('{}{}{} {}'.format(PREFIX, name, _labels(labels), value))
+    for (name, labels), histogram in histograms:
+        if name not in seen:
+            seen.add(name)
+            lines.append('# TYPE {}{} histogram'.format(PREFIX, name))
+        # buckets are stored per bound already, so they are cumulative as written
+        for bound, count in zip(BUCKETS, histogram):
+            lines.append('{}{}_bucket{} {}'.format(PREFIX, name, _labels(labels, [('le', bound)]), count))
+        lines.append('{}{}_bucket{} {}'.format(PREFIX, name, _labels(labels, [('le', '+Inf')]), histogram[-2]))
+        lines.append('{}{}_sum{} {}'.format(PREFIX, name, _labels(labels), histogram[-1]))
+        lines.append('{}{}_count{} {}'.format(PREFIX, name, _labels(labels), histogram[-2]))
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
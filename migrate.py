@@ -0,0 +1,43 @@
+###
+# One-shot copy of a TinyDB file (dev.db/prod.db) into a SQLite store
+#
+# python migrate.py prod.db prod.sqlite
+# then set db_backend = 'sqlite' and db_file = 'prod.sqlite' in config.py
+##
+import sys
+import time
+
+from tinydb import TinyDB
+
+import store
+
+
+def main(tinydb_file, sqlite_file):
+    source = TinyDB(tinydb_file)
+    target = store.SQLiteBackend(sqlite_file)
+    if target.tables():
+        print('{} already has data, not migrating.'.format(sqlite_file))
+        return False
+
+    started = time.time()
+    members = [dict(_) for _ in source.table('Member').all()]
+    admins = [dict(_) for _ in source.table('Admin').all()]
+    rsvps = [dict(_) for _ in source.table('RSVP').all()]
+    invites = [dict(_) for _ in source.table('Invite').all()]
+    # keep sub exactly as stored, but fill in fields that very old rows may lack
+    for rsvp in rsvps:
+        rsvp.setdefault('sub', None)
+    target.insert_members(members)
+    target.insert_admins(admins)
+    target.insert_rsvps(rsvps)
+    target.insert_invites(invites)
+    print('Migrated {} members, {} admins and {} RSVPs in {:.1f}s'.format(len(members), len(admins), len(rsvps),
+                                                                         time.time() - started))
+    return True
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('usage: python migrate.py <tinydb file> <sqlite file>')
+        sys.exit(1)
+    main(sys.argv[1], sys.argv[2])
@@ -0,0 +1,123 @@
+###
+# Durable outbound SMS queue (SQLite), drained by a background worker
+##
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+
+OUTBOX_FILE = getattr(config, 'outbox_file', None)  # None sends inline, without queueing
+MAX_ATTEMPTS = getattr(config, 'outbox_max_attempts', 5)
+BATCH = 100  # messages claimed per drain
+LEASE = 300  # seconds a claimed batch stays hidden from other workers
+RETRY_DELAY = 30  # seconds before a failed message is tried again
+POLL = 5  # seconds between checks when nothing wakes the worker
+
+
+class Outbox(object):
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.worker = None
+        with self.transaction() as c:
+            c.execute('CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                      'phone TEXT NOT NULL, name TEXT, body TEXT NOT NULL, created REAL NOT NULL, '
+                      'attempts INTEGER NOT NULL DEFAULT 0, claimed_until REAL NOT NULL DEFAULT 0, sender TEXT)')
+            if 'sender' not in [column[1] for column in c.execute('PRAGMA table_info(outbox)')]:
+                # outbox files from before groups
+                c.execute('ALTER TABLE outbox ADD COLUMN sender TEXT')
+            c.execute('CREATE TABLE IF NOT EXISTS failed (id INTEGER PRIMARY KEY, phone TEXT NOT NULL, name TEXT, '
+                      'body TEXT NOT NULL, created REAL NOT NULL, attempts INTEGER NOT NULL, error TEXT)')
+        self.conn.execute('PRAGMA journal_mode=WAL')
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so claims are atomic across processes too
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.conn
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+
+    def enqueue(self, jobs, sender=None):
+        # jobs: list of (member, message) pairs, sender: the number to send from (None for the default)
+        now = time.time()
+        rows = [(member['phone'], member.get('name'), body, now, sender) for member, body in jobs]
+        with self.transaction() as c:
+            c.executemany('INSERT INTO outbox (phone, name, body, created, sender) VALUES (?, ?, ?, ?, ?)', rows)
+        self.wakeup.set()
+        return len(rows)
+
+    def claim(self, limit=BATCH):
+        now = time.time()
+        with self.transaction() as c:
+            rows = c.execute('SELECT id, phone, name, body, created, attempts, sender FROM outbox '
+                             'WHERE claimed_until < ? ORDER BY id LIMIT ?', (now, limit)).fetchall()
+            c.executemany('UPDATE outbox SET claimed_until = ?, attempts = attempts + 1 WHERE id = ?',
+                          [(now + LEASE, row[0]) for row in rows])
+        return rows
+
+    def finish(self, rows, results):
+        # drop delivered messages, back off or give up on the rest
+        retry_at = time.time() + RETRY_DELAY
+        with self.transaction() as c:
+            for row, result in zip(rows, results):
+                if result['status'] == 'sent':
+                    c.execute('DELETE FROM outbox WHERE id = ?', (row[0],))
+                elif row[5] + 1 >= MAX_ATTEMPTS:
+                    c.execute('INSERT OR REPLACE INTO failed VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              row[:5] + (row[5] + 1, result['error']))
+                    c.execute('DELETE FROM outbox WHERE id = ?', (row[0],))
+                else:
+                    c.execute('UPDATE outbox SET claimed_until = ? WHERE id = ?', (retry_at, row[0]))
+
+    def pending(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def drain(self, deliver):
+        # deliver: callable(jobs) -> fanout summary. Returns the number of messages handled
+        rows = self.claim()
+        if rows:
+            summary = deliver([({'phone': row[1], 'name': row[2], 'sender': row[6]}, row[3]) for row in rows])
+            self.finish(rows, summary['results'])
+        return len(rows)
+
+    def run(self, deliver):
+        while True:
+            try:
+                if self.drain(deliver):
+                    continue
+            except Exception as e:
+                print('Outbox worker error:', e)
+            self.wakeup.wait(POLL)
+            self.wakeup.clear()
+
+    def start(self, deliver):
+        # queued messages from before a restart are picked up by the first drain
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self.run, args=(deliver,), name='outbox', daemon=True)
+                self.worker.start()
+        return self.worker
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox():
+    global _outbox
+    if OUTBOX_FILE is None:
+        return None
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox(OUTBOX_FILE)
+    return _outbox
@@ -16,16 +16,18 @@ X 5. Send non-RSVP responses from Members to Master Members
 """
 
 import csv
-import datetime
 import configparser
 import os
 
+import journal
+import schedule
 import sms
 
 # get module config values
 import config
 
 # Database: I will be using a text flat file to keep track of responses. One file per weekly game.
+#  Replies are appended to a journal next to it (see journal.py) and compacted into the file.
 
 # MEMBER_LIST: A Dict of Member cell phone numbers and their name. {cell phone number, name}
 MEMBER_LIST = config.MEMBER_LIST
@@ -42,30 +44,12 @@ MASTER_MEMBERS = config.MASTER_MEMBERS
 
 RESPONSE_TYPES = {'n': 'No', 'y': 'Yes'}
 FIELDNAMES = 'phone_number,name,rsvp'.split(',')
-Thursday = 4
 game_time = None
 
 
 def get_game_time():
-    today = datetime.date.today()
-    day_of_the_week = today.isoweekday()
-    days_till_game = None
-    # When is next game? Today = x, # of days in week = 7, Game day (Thursday) = 4
-    if day_of_the_week - Thursday > 0:
-        # of days till next game is (7-x)+4
-        days_till_game = (7 - day_of_the_week) + Thursday
-    elif Thursday - day_of_the_week > 0:
-        days_till_game = Thursday - day_of_the_week
-    # else: #Today is Thursday
-    # if it is Thursday before game time, give today's date
-    # if it is Thursday after game time, give next Thursday's date
-
-    if days_till_game:
-        game_time = datetime.datetime.combine(today + datetime.timedelta(days_till_game), datetime.time(hour=20))
-    else:
-        game_time = datetime.datetime.combine(today, datetime.time(hour=20))
-
-    return game_time
+    # same schedule as app.get_next_game (config.event_weekday/hour/minute or event_slots), as a naive datetime
+    return schedule.get_schedule().next_game().naive
 
 
 def get_rsvp_file():
@@ -101,22 +85,14 @@ def send_sms_to_masters(message):
 def rsvp_update(caller_did, rsvp_reply):
     # caller_did: string containing cell phone number of member
     # rsvp_reply: string containing a 'y' or 'n' response to rsvp request
-    # Read in Game file
-    rsvp_list = get_rsvp_list()
-    # Update/Add RSVP for caller
+    # Game journal, replayed into memory when first opened
+    game_journal = journal.get_journal(get_rsvp_file())
+    # Update/Add RSVP for caller: one line appended to the journal
+    previous = game_journal.append(caller_did, MEMBER_LIST[caller_did], rsvp_reply)
     # - Check for update, if so, notify Admin(s)
-    if caller_did in rsvp_list.keys() and rsvp_reply != rsvp_list[caller_did]['rsvp']:
+    if previous is not None and rsvp_reply != previous['rsvp']:
         send_sms_to_masters('{} has changed RSVP from {} to {}'.format(MEMBER_LIST[caller_did],
-                                                                       rsvp_list[caller_did]['rsvp'], rsvp_reply))
-    rsvp_list[caller_did] = {'name': MEMBER_LIST[caller_did], 'rsvp': rsvp_reply}
-    update_list = []
-    for member_did in rsvp_list:
-        data_list = [member_did, rsvp_list[member_did]['name'], rsvp_list[member_did]['rsvp']]
-        # add Dict to List for updates
-        update_list.append(dict(zip(FIELDNAMES, data_list)))
-    with open(get_rsvp_file(), 'w', newline='') as fout:
-        # update file with rsvp details
-        csv_dict_writer(fout, FIELDNAMES, update_list)
+                                                                       previous['rsvp'], rsvp_reply))
     # Thank them for response
     return "Thank you for RSVPing '{}' to the next game on {}!\nYou can update your RSVP by sending a 'Y' or 'N'." \
            " Or see the RSVP list by sending 'L'.".format(RESPONSE_TYPES[rsvp_reply], get_game_time().
@@ -124,12 +100,8 @@ def rsvp_update(caller_did, rsvp_reply):
 
 
 def get_rsvp_list():
-    rsvp_list = {}
-    with open(get_rsvp_file(), 'r') as csvfile:
-        csvreader = csv_dict_reader(csvfile)
-        for entry in csvreader:
-            rsvp_list[entry['phone_number']] = {'name': entry['name'], 'rsvp': entry['rsvp']}
-    return rsvp_list
+    # {phone: {'name', 'rsvp'}} from memory, no file read
+    return journal.get_journal(get_rsvp_file()).get_rows()
 
 
 def send_list():
@@ -150,11 +122,11 @@ def send_list():
 def start_poll():
     # Start polling process:
     # todo: check if poll file already exists, notify user if so
-    if os.path.isfile(get_rsvp_file()):
+    game_journal = journal.get_journal(get_rsvp_file())
+    if game_journal.exists():
         return "Poll already exists, please use '!' to nag Members."
     # create poll file
-    with open(get_rsvp_file(), 'w', newline='') as fout:
-        csv_dict_writer(fout, FIELDNAMES, data=False)
+    game_journal.compact()
     # Send Poll
     send_poll(MEMBER_LIST)
     return "Poll has been sent!"
@@ -1,39 +1,85 @@
-from flask import Flask, request, redirect
-from tinydb import TinyDB, Query
+import os
+
+from flask import Flask, Response, abort, request, redirect
 from twilio.twiml.messaging_response import Body, Message, Redirect, MessagingResponse
 
 import app
+import archive
 import config
+import dedupe
+import groups
+import metrics
+import scheduler
+import store
 
 wsgi = Flask(__name__)
 
 
 @wsgi.route("/dweb/", methods=['GET', 'POST'])
-def hello_monkey():
-    phone_from = request.values.get('From', None)
-    if app.is_member(phone_from):
-        body = request.values.get('Body', None)
-        message = Message()
-        message.body(app.main(phone_from, body))
-    else:
-        return None
+@wsgi.route("/dweb/<group>/", methods=['GET', 'POST'])
+def hello_monkey(group=None):
+    return handle_sms(request.values, request.path, group)
+
+
+def handle_sms(values, path, group=None):
+    # values: the Twilio form fields, group: the group named in the URL (if any).
+    #  Shared with the asyncio server in asgi.py
+    metrics.start_request()
+    tenant = None
+    if groups.GROUPS:
+        # with config.groups: the group from the URL, else the one that owns the number texted (To)
+        tenant = groups.route(group, values.get('To', None))
+        if tenant is None:
+            # not ours: acknowledge, so Twilio doesn't retry
+            return str(MessagingResponse())
+    elif group is not None:
+        return str(MessagingResponse())
+    with groups.use(tenant), metrics.span('webhook'):
+        phone_from = values.get('From', None)
+        resp = None
+        if app.is_member(phone_from):
+            body = values.get('Body', None)
+            # a Twilio retry of a message we already handled gets the original reply back
+            resp = dedupe.run_once(values.get('MessageSid', None), lambda: reply(phone_from, body))
+    metrics.end_request(path=path)
+
+    # nothing to say (not a member, or no reply): an empty response, so Twilio doesn't retry
+    return resp or str(MessagingResponse())
+
+
+def reply(phone_from, body):
+    message = Message()
+    message.body(app.main(phone_from, body))
 
     resp = MessagingResponse()
     resp.append(message)
-
     return str(resp)
 
 
+@wsgi.route("/metrics", methods=['GET'])
+def metrics_page():
+    if not metrics.ENABLED:
+        abort(404)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 def init_db():
-    db = TinyDB(config.db_file)
+    db = store.get_store()
+    if archive.KEEP_SEASONS:
+        # keep the live table to the last few seasons
+        archive.archive_seasons(db, archive.KEEP_SEASONS)
     if len(db.tables()) > 1:
         return True
-    member_table = db.table('Member')
-    member_table.insert_multiple(config.member_list)
-    admin_table = db.table('Admin')
-    admin_table.insert_multiple(config.admin_members)
+    db.add_members(config.member_list)
+    db.add_admins(config.admin_members)
 
 if __name__ == "__main__":
     # Load and check DB
     init_db()
+    # send anything left in the outbox from before a restart
+    app.start_outbox()
+    # polls and reminders from config.reminder_offsets, in the process that serves requests: with
+    #  debug on, the reloader's parent process runs this too
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        scheduler.start()
     wsgi.run(debug=True, port=6543)
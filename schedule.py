@@ -0,0 +1,106 @@
+###
+# Game schedule: weekly slots, skipped dates and one-off games, precomputed and sorted
+#
+# A game stays "the next game" until the end of its day (or until it starts, when another game
+# follows on the same day), matching how get_next_game has always treated game day.
+##
+import bisect
+import threading
+import time
+
+import arrow
+
+import config
+import groups
+
+HORIZON_WEEKS = 8  # how far ahead occurrences are precomputed
+
+
+def weekly_slots(settings=config):
+    # [(iso weekday, hour, minute)], defaulting to the single event_weekday/hour/minute slot
+    slots = getattr(settings, 'event_slots', None)
+    if not slots:
+        slots = [(settings.event_weekday, settings.event_hour, settings.event_minute)]
+    return slots
+
+
+class Schedule(object):
+    def __init__(self, slots, skip_dates=(), extra_games=(), tz='local', horizon_weeks=HORIZON_WEEKS):
+        # event_weekday counts from isoweekday(), with 0 meaning Sunday
+        self.slots = [((weekday - 1) % 7 + 1, hour, minute) for weekday, hour, minute in slots]
+        self.skip_dates = set(skip_dates)  # 'YYYY-MM-DD'
+        self.extra_games = list(extra_games)  # 'YYYY-MM-DD HH:mm'
+        self.tz = tz
+        self.horizon_weeks = horizon_weeks
+        self.lock = threading.Lock()
+        self.games = []  # sorted arrow times
+        self.cutoffs = []  # epoch seconds at which games[i] stops being the next game
+        self.cached = None  # (valid from, valid until, game)
+
+    def build(self, now):
+        # every occurrence from the start of last week to the horizon
+        week = now.floor('week').shift(weeks=-1)
+        games = set()
+        for _ in range(self.horizon_weeks + 2):
+            for weekday, hour, minute in self.slots:
+                game = week.shift(days=weekday - 1).replace(hour=hour, minute=minute).floor('minute')
+                if game.format('YYYY-MM-DD') not in self.skip_dates:
+                    games.add(game)
+            week = week.shift(weeks=1)
+        for extra in self.extra_games:
+            games.add(arrow.get(extra, 'YYYY-MM-DD HH:mm', tzinfo=now.tzinfo).floor('minute'))
+        games = sorted(games)
+        cutoffs = []
+        for i, game in enumerate(games):
+            end_of_day = game.ceil('day')
+            if i + 1 < len(games) and games[i + 1] < end_of_day:
+                cutoffs.append(game.timestamp)
+            else:
+                cutoffs.append(end_of_day.timestamp + 1)
+        self.games = games
+        self.cutoffs = cutoffs
+
+    def next_game(self, now=None):
+        # the game to RSVP for at `now` (an arrow time, default now)
+        t = time.time() if now is None else now.timestamp
+        cached = self.cached
+        if cached is not None and cached[0] <= t < cached[1]:
+            return cached[2]
+        with self.lock:
+            if not self.cutoffs or t >= self.cutoffs[-1] or t < self.cutoffs[0]:
+                self.build(arrow.now(self.tz) if now is None else now.to(self.tz))
+            i = bisect.bisect_right(self.cutoffs, t)
+            if i >= len(self.games):
+                # nothing left inside the horizon (everything skipped); look further out
+                self.build(self.games[-1].shift(weeks=1) if self.games else arrow.now(self.tz).shift(weeks=1))
+                i = bisect.bisect_right(self.cutoffs, t)
+            game = self.games[i]
+            self.cached = (self.cutoffs[i - 1] if i > 0 else t, self.cutoffs[i], game)
+        return game
+
+    def upcoming(self, count, now=None):
+        # the next `count` games, starting with next_game(now)
+        game = self.next_game(now)
+        with self.lock:
+            i = self.games.index(game)
+            if i + count > len(self.games):
+                self.build(game)
+                i = self.games.index(game)
+            return self.games[i:i + count]
+
+
+_schedule = None
+_schedule_lock = threading.Lock()
+
+
+def get_schedule():
+    # the current group's schedule while one of config.groups is handled
+    group = groups.current()
+    if group is not None:
+        return group.schedule
+    global _schedule
+    with _schedule_lock:
+        if _schedule is None:
+            _schedule = Schedule(weekly_slots(), getattr(config, 'skip_dates', ()), getattr(config, 'extra_games', ()),
+                                 getattr(config, 'event_timezone', 'local'))
+    return _schedule
@@ -0,0 +1,177 @@
+###
+# Polls and reminders sent from the running server, instead of a cron job starting a fresh process
+#
+# config.reminder_offsets lists (job, seconds before the game). Jobs for the next few games wait in a
+# heap ordered by fire time; what has been sent is saved to config.scheduler_file, so after a restart
+# only what was missed while down is sent (just the latest missed job per game, not all of them).
+# Only one process runs jobs: the one holding an flock on <scheduler_file>.lock. The others wait for
+# it, and take over if it exits. With config.groups, every group's games are planned from its own
+# schedule (and reminder_offsets, if it sets them), and its jobs run with that group current.
+##
+import heapq
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: the webhook still runs, but not the scheduler
+    fcntl = None
+
+import app
+import config
+import groups
+import schedule
+
+# e.g. [('poll', 3 * 24 * 3600), ('reminder', 24 * 3600), ('reminder', 3 * 3600)]
+OFFSETS = getattr(config, 'reminder_offsets', [])
+STATE_FILE = getattr(config, 'scheduler_file', 'scheduler.json')
+LOOKAHEAD = 2  # games planned ahead
+KEEP = 14 * 24 * 3600  # seconds a sent job is remembered after its game
+
+JOBS = {
+    'poll': lambda game: app.send_invite(game=game),  # everyone
+    'reminder': lambda game: app.send_reminder(game=game),  # members who haven't replied
+}
+
+
+class Scheduler(object):
+    def __init__(self, offsets, state_file, jobs=JOBS):
+        self.offsets = offsets
+        self.state_file = state_file
+        self.jobs = jobs
+        self.cond = threading.Condition()
+        self.heap = []  # (fire at, key, job, game, group name)
+        self.planned = set()
+        self.sent = {}  # key -> when it was sent (or skipped), loaded once the lock is ours
+        self.worker = None
+        self.lock_file = None
+
+    def load(self):
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def save(self):
+        # write and rename, so a crash never leaves half a file
+        cutoff = time.time() - KEEP
+        self.sent = dict((k, v) for k, v in self.sent.items() if int(k.split(':')[0]) > cutoff)
+        tmp = self.state_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.sent, f)
+        os.replace(tmp, self.state_file)
+
+    def plan(self, now):
+        # queue the jobs of the next LOOKAHEAD games that haven't run, for every group
+        changed = False
+        for name in sorted(groups.GROUPS) or [None]:
+            # planned from the group's schedule alone; its store is only loaded when a job fires
+            if name is None:
+                changed |= self.plan_group(now, None, schedule.get_schedule(), self.offsets)
+            else:
+                offsets = groups.GROUPS[name].get('reminder_offsets', self.offsets)
+                changed |= self.plan_group(now, name, groups.get_schedule(name), offsets)
+        if changed:
+            self.save()
+
+    def plan_group(self, now, name, games, offsets):
+        # returns True if missed jobs were marked as sent
+        changed = False
+        for game in games.upcoming(LOOKAHEAD):
+            if game.timestamp <= now:
+                continue
+            missed = []
+            for job, offset in offsets:
+                key = '{}:{}:{}'.format(game.timestamp, job, offset)
+                if name is not None:
+                    key += ':' + name
+                if key in self.sent or key in self.planned:
+                    continue
+                fire_at = game.timestamp - offset
+                if fire_at <= now:
+                    missed.append((fire_at, key, job, game, name))
+                else:
+                    heapq.heappush(self.heap, (fire_at, key, job, game, name))
+                    self.planned.add(key)
+            if missed:
+                # catching up after downtime: only the latest missed job is still worth sending
+                missed.sort()
+                for item in missed[:-1]:
+                    self.sent[item[1]] = now
+                    changed = True
+                heapq.heappush(self.heap, missed[-1])
+                self.planned.add(missed[-1][1])
+        return changed
+
+    def fire(self, item):
+        fire_at, key, job, game, name = item
+        if game.timestamp > time.time():
+            try:
+                with groups.use(groups.get_group(name) if name is not None else None):
+                    result = self.jobs[job](game)
+                print('Scheduled {} for {}: {}'.format(job, game.format('YYYY-MM-DD HH:mm'), result))
+            except Exception as e:
+                print('Scheduled {} for {} failed: {}'.format(job, game.format('YYYY-MM-DD HH:mm'), e))
+        with self.cond:
+            self.planned.discard(key)
+            self.sent[key] = time.time()
+            self.save()
+
+    def run_pending(self):
+        # fire whatever is due; returns seconds until the next job (None if nothing is planned)
+        while True:
+            with self.cond:
+                now = time.time()
+                self.plan(now)
+                if not self.heap:
+                    return None
+                if self.heap[0][0] > now:
+                    return self.heap[0][0] - now
+                item = heapq.heappop(self.heap)
+            self.fire(item)
+
+    def acquire(self):
+        # blocks until no other process is running jobs, then picks up what it sent
+        if self.lock_file is not None:
+            return
+        lock_file = open(self.state_file + '.lock', 'a')
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        self.lock_file = lock_file
+        with self.cond:
+            self.sent = self.load()
+
+    def run(self):
+        self.acquire()
+        while True:
+            wait = self.run_pending()
+            with self.cond:
+                # wake up at least hourly to plan games that came into view
+                self.cond.wait(3600 if wait is None else min(wait, 3600))
+
+    def start(self):
+        with self.cond:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self.run, name='scheduler', daemon=True)
+                self.worker.start()
+        return self.worker
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def start():
+    # no-op unless config.reminder_offsets is set
+    global _scheduler
+    if not OFFSETS:
+        return None
+    if fcntl is None:
+        raise RuntimeError('reminder_offsets needs fcntl (a POSIX system) to run jobs in one process only')
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler(OFFSETS, STATE_FILE)
+        _scheduler.start()
+    return _scheduler
@@ -0,0 +1,87 @@
+###
+# SMS segment counting, so replies and broadcasts can be kept to as few billed segments as possible
+#
+# A message that fits the GSM-7 alphabet is sent 160 characters to a segment (153 each once it is split).
+# A single character outside it, like an emoji or a curly quote, sends the whole message as UCS-2:
+# 70 characters to a segment, 67 once split.
+##
+import math
+
+GSM7 = set('@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !"#¤%&\'()*+,-./0123456789:;<=>?¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§'
+           '¿abcdefghijklmnopqrstuvwxyzäöñüà')
+GSM7_EXTENDED = set('^{}\\[~]|€\f')  # sent as an escape plus the character, so they count twice
+
+# characters phones like to substitute while typing, and the GSM-7 ones that read the same
+GSM7_LOOKALIKES = {
+    '‘': "'", '’': "'", '‚': "'", '‛': "'", '′': "'",
+    '“': '"', '”': '"', '„': '"', '″': '"',
+    '–': '-', '—': '-', '−': '-', '…': '...', ' ': ' ', '•': '-',
+}
+
+LIMITS = {
+    # encoding: (single segment, each segment of a split message)
+    'GSM-7': (160, 153),
+    'UCS-2': (70, 67),
+}
+
+
+def encoding(text):
+    if all(c in GSM7 or c in GSM7_EXTENDED for c in text):
+        return 'GSM-7'
+    return 'UCS-2'
+
+
+def length(text, charset=None):
+    # in GSM-7 septets or UTF-16 code units
+    charset = charset or encoding(text)
+    if charset == 'GSM-7':
+        return len(text) + len([c for c in text if c in GSM7_EXTENDED])
+    return len(text.encode('utf-16-le')) // 2
+
+
+def count(text):
+    # billed segments for one message
+    charset = encoding(text)
+    single, split = LIMITS[charset]
+    units = length(text, charset)
+    if units <= single:
+        return 1
+    return int(math.ceil(units / float(split)))
+
+
+def to_gsm(text):
+    # swap curly quotes, dashes and the like for their GSM-7 lookalikes; anything else is left alone
+    return ''.join(GSM7_LOOKALIKES.get(c, c) for c in text)
+
+
+def fit(candidates):
+    # the first message that fits in one segment, otherwise the one with the fewest segments
+    for text in candidates:
+        if count(text) == 1:
+            return text
+    return min(candidates, key=count)
+
+
+def cost(bodies):
+    # projected {'messages', 'segments', 'ucs2'} for sending each of `bodies` once
+    bodies = list(bodies)
+    return {'messages': len(bodies), 'segments': sum(count(body) for body in bodies),
+            'ucs2': len([body for body in bodies if encoding(body) == 'UCS-2'])}
+
+
+def paginate(header, lines, max_segments=1, more='({page}/{pages})'):
+    # split header + lines into pages of at most max_segments each, breaking only between lines.
+    # Every page starts with the header and, when there is more than one, ends with `more`
+    if count('\n'.join([header] + lines)) <= max_segments:
+        return ['\n'.join([header] + lines)]
+    footer = more.format(page=99, pages=99, next=99)
+    pages = []
+    page = []
+    for line in lines:
+        if page and count('\n'.join([header] + page + [line, footer])) > max_segments:
+            pages.append(page)
+            page = []
+        page.append(line)
+    pages.append(page)
+    return ['\n'.join([header] + page + [more.format(page=i + 1, pages=len(pages), next=(i + 1) % len(pages) + 1)])
+            for i, page in enumerate(pages)]
@@ -31,4 +31,8 @@ setup(name='sms_rsvp_app',
       include_package_data=True,
       zip_safe=False,
       install_requires=requires,
+      extras_require={
+          'asgi': ['uvicorn'],
+          'analytics': ['numpy'],
+      },
       )
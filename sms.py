@@ -1,15 +1,89 @@
 # Download the twilio-python library from http://twilio.com/docs/libraries
-from twilio.rest import Client
+import importlib
+import threading
 
 # get module config values
 import config
+import groups
+import metrics
+import segments
 
 # Find these values at https://twilio.com/user/account
 account_sid = config.account_sid
 auth_token = config.auth_token
-client = Client(account_sid, auth_token)
 DID_from = config.DID_from
+POOL_SIZE = getattr(config, 'sms_pool_size', 10)  # keep-alive connections to the Twilio API
+API_URL = getattr(config, 'sms_api_url', None)  # point the client at a Twilio compatible stand-in
+# 'module.function' called as function(DID_to, DID_from, body) instead of the Twilio API
+TRANSPORT = getattr(config, 'sms_transport', None)
 
+_client = None
+_transport = None
+_lock = threading.Lock()
 
-def send_sms(DID_to, body):
-    message = client.messages.create(to=DID_to, from_=DID_from, body=body)
+
+def get_client():
+    # Twilio is imported and the client built on first use, so importing app stays cheap
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                from requests.adapters import HTTPAdapter
+                from twilio.http.http_client import TwilioHttpClient
+                from twilio.rest import Client
+
+                http_client = TwilioHttpClient(pool_connections=True)
+                # one pooled keep-alive connection per concurrent sender (see fanout.py)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+                http_client.session.mount('https://', adapter)
+                http_client.session.mount('http://', adapter)
+                client = Client(account_sid, auth_token, http_client=http_client)
+                if API_URL:
+                    client.api.base_url = API_URL
+                _client = client
+    return _client
+
+
+def twilio_transport(DID_to, DID_from, body):
+    return get_client().messages.create(to=DID_to, from_=DID_from, body=body)
+
+
+def console_transport(DID_to, DID_from, body):
+    print('SMS {} -> {}: {}'.format(DID_from, DID_to, body))
+
+
+def set_transport(transport):
+    # transport: callable(DID_to, DID_from, body), or None for the configured default
+    global _transport
+    _transport = transport
+
+
+def get_transport():
+    global _transport
+    if _transport is None:
+        if TRANSPORT:
+            module, name = TRANSPORT.rsplit('.', 1)
+            _transport = getattr(importlib.import_module(module), name)
+        else:
+            _transport = twilio_transport
+    return _transport
+
+
+def sender():
+    # the number messages go out from: the current group's, else config.DID_from
+    group = groups.current()
+    if group is not None and group.phone:
+        return group.phone
+    return DID_from
+
+
+def send_sms(DID_to, body, DID_from=None):
+    try:
+        with metrics.span('sms_send'):
+            message = get_transport()(DID_to, DID_from or sender(), body)
+    except Exception:
+        metrics.inc('sms_total', status='failed')
+        raise
+    metrics.inc('sms_total', status='sent')
+    metrics.inc('sms_segments_total', segments.count(body))
+    return message
@@ -0,0 +1,116 @@
+###
+# 3. STANDBY list for games with limited space
+#
+# With config.game_capacity set, a 'yes' that doesn't fit is recorded as a 'standby' reply and
+# queued in a heap, best attendance first, then earliest signup. When someone drops out the top
+# of the heap is promoted into the freed spots.
+##
+import heapq
+import threading
+import time
+
+import config
+import groups
+import store
+
+CAPACITY = getattr(config, 'game_capacity', 0)  # players per game, members plus subs. 0 for no limit
+
+
+def capacity():
+    # a group can set its own game_capacity
+    group = groups.current()
+    if group is not None and 'game_capacity' in group.settings.values:
+        return group.settings.values['game_capacity']
+    return CAPACITY
+
+
+class StandbyList(object):
+    def __init__(self, db, game):
+        self.db = db
+        self.game = game
+        self.heap = []  # (-attendance, signup timestamp, name)
+        self.queued = set()  # (name, signup timestamp) in the heap, so a reply is never queued twice
+        # one pass when the list is first needed, pushes after that
+        for rsvp in db.get_game_rsvps(game).values():
+            if rsvp['reply'] == 'standby':
+                self.push(rsvp)
+
+    def push(self, rsvp):
+        # a list built just now from the store may already hold the reply being added
+        if (rsvp['name'], rsvp['timestamp']) in self.queued:
+            return
+        self.queued.add((rsvp['name'], rsvp['timestamp']))
+        heapq.heappush(self.heap, (-self.db.get_attendance(rsvp['name']), rsvp['timestamp'], rsvp['name']))
+
+    def _current(self, entry):
+        # entries are left in place when a member changes their reply, and skipped here
+        rsvp = self.db.get_rsvp(self.game, entry[2])
+        if rsvp is None or rsvp['reply'] != 'standby' or rsvp['timestamp'] != entry[1]:
+            return None
+        return rsvp
+
+    def promote(self, free):
+        # pop standby RSVPs, best first, while they fit into `free` spots
+        promoted = []
+        names = set()
+        while self.heap:
+            rsvp = self._current(self.heap[0])
+            if rsvp is None or rsvp['name'] in names:
+                self.pop()
+                continue
+            needed = 1 + int(rsvp['sub'] or 0)
+            if needed > free:
+                break
+            self.pop()
+            promoted.append(rsvp)
+            names.add(rsvp['name'])
+            free -= needed
+        return promoted
+
+    def pop(self):
+        entry = heapq.heappop(self.heap)
+        self.queued.discard((entry[2], entry[1]))
+        return entry
+
+    def __len__(self):
+        return len(self.heap)
+
+
+_lock = threading.Lock()
+
+
+def get_list(db, game):
+    with _lock:
+        lists = db.views.setdefault('standby', {})  # game -> StandbyList
+        standby = lists.get(game)
+        if standby is None:
+            # games more than a day old don't need their lists any more
+            for old in [g for g in lists if g < time.time() - 24 * 3600]:
+                del lists[old]
+            standby = lists[game] = StandbyList(db, game)
+    return standby
+
+
+def free_spots(db, game, rsvp=None):
+    # open spots for a game, counting the spots `rsvp` (a member's current reply) already holds as free
+    return capacity() - db.get_spots(game) + store.players(rsvp)
+
+
+def fits(db, game, sub, current=None):
+    if not capacity():
+        return True
+    return 1 + int(sub or 0) <= free_spots(db, game, current)
+
+
+def add(db, game, rsvp):
+    get_list(db, game).push(rsvp)
+
+
+def promote(db, game):
+    # standby RSVPs that now fit, best first; the caller records them as 'yes'
+    if not capacity():
+        return []
+    free = free_spots(db, game)
+    if free <= 0:
+        return []
+    return get_list(db, game).promote(free)
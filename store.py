@@ -0,0 +1,524 @@
+###
+# Long-lived database handle with in-memory lookup indexes
+#
+# Store keeps the indexes; the Member, Admin, RSVP and Invite tables live in a backend:
+#   TinyDBBackend - the original JSON file
+#   SQLiteBackend - indexed SQLite file in WAL mode (see migrate.py to convert a TinyDB file)
+# Past seasons of RSVPs can be moved out of the backend into compressed archives, see archive.py
+# With config.db_shared, several worker processes can share one database, see coherence.py
+##
+import atexit
+import sqlite3
+import threading
+
+from tinydb import TinyDB, Query
+from tinydb.middlewares import CachingMiddleware
+from tinydb.storages import JSONStorage
+
+import archive
+import coherence
+import config
+import groups
+import metrics
+
+DB_BACKEND = getattr(config, 'db_backend', 'tinydb')
+# write-behind for RSVP inserts: buffer replies and write them in one batch every FLUSH_MS
+#  or every FLUSH_ROWS replies, whichever comes first. 0 writes every reply straight away
+FLUSH_MS = getattr(config, 'rsvp_flush_ms', 0)
+FLUSH_ROWS = getattr(config, 'rsvp_flush_rows', 50)
+
+RSVP_FIELDS = ['name', 'game', 'reply', 'sub', 'timestamp']
+SCAN_BATCH = 10000  # RSVPs per batch when streaming the whole history
+
+
+def players(rsvp):
+    # spots an RSVP takes up: the member plus any subs, for a 'yes'
+    if rsvp is None or rsvp['reply'] != 'yes':
+        return 0
+    return 1 + int(rsvp['sub'] or 0)
+
+
+class WriteThroughCache(CachingMiddleware):
+    # Keep the parsed JSON file in memory, but write every change straight back to disk
+    WRITE_CACHE_SIZE = 1
+
+
+class TinyDBBackend(object):
+    def __init__(self, db_file):
+        self.db = TinyDB(db_file, storage=WriteThroughCache(JSONStorage))
+        self.member_tbl = self.db.table('Member')
+        self.admin_tbl = self.db.table('Admin')
+        self.rsvp_tbl = self.db.table('RSVP')
+        self.invite_tbl = self.db.table('Invite')
+
+    def tables(self):
+        return self.db.tables()
+
+    def refresh(self):
+        # forget the cached file after another worker wrote to it. Tables also cache their next doc id,
+        #  which would hand out ids the other worker already used
+        self.db.storage.cache = None
+        for table in [self.member_tbl, self.admin_tbl, self.rsvp_tbl, self.invite_tbl]:
+            table.clear_cache()
+            table._next_id = None
+
+    def members(self):
+        return self.member_tbl.all()
+
+    def admins(self):
+        return self.admin_tbl.all()
+
+    def latest_rsvps(self):
+        # no indexes here, so the caller keeps the newest reply while walking the history
+        return self.rsvp_tbl.all()
+
+    def rsvp_history(self, game, name=None):
+        Rsvp = Query()
+        query = Rsvp.game == game
+        if name is not None:
+            query &= Rsvp.name == name
+        return sorted(self.rsvp_tbl.search(query), key=lambda r: r['timestamp'])
+
+    def rsvps_since(self, last_id):
+        # RSVPs written after doc id last_id, and the newest id
+        rsvps = [r for r in self.rsvp_tbl.all() if r.doc_id > last_id]
+        return rsvps, max([r.doc_id for r in rsvps] or [last_id])
+
+    def last_rsvp_id(self):
+        return max([r.doc_id for r in self.rsvp_tbl.all()] or [0])
+
+    def rsvps_before(self, game):
+        return self.rsvp_tbl.search(Query().game < game)
+
+    def delete_rsvps_before(self, game):
+        self.rsvp_tbl.remove(Query().game < game)
+
+    def scan_rsvps(self, batch=SCAN_BATCH):
+        # every RSVP as (name, game, reply, sub, timestamp) tuples, a batch at a time
+        rows = self.rsvp_tbl.all()
+        for i in range(0, len(rows), batch):
+            yield [(r['name'], r['game'], r['reply'], r.get('sub'), r['timestamp']) for r in rows[i:i + batch]]
+
+    def invites(self):
+        return self.invite_tbl.all()
+
+    def insert_members(self, members):
+        self.member_tbl.insert_multiple(members)
+
+    def insert_admins(self, admins):
+        self.admin_tbl.insert_multiple(admins)
+
+    def insert_rsvps(self, rsvps):
+        # one file write for the whole batch
+        self.rsvp_tbl.insert_multiple(rsvps)
+
+    def insert_invites(self, invites):
+        self.invite_tbl.insert_multiple(invites)
+
+
+class SQLiteBackend(object):
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS member (id INTEGER PRIMARY KEY, name TEXT NOT NULL, phone TEXT NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS member_phone ON member (phone)',
+        'CREATE TABLE IF NOT EXISTS admin (id INTEGER PRIMARY KEY, name TEXT NOT NULL)',
+        # sub is left untyped so None, 0 and '2' come back exactly as they went in
+        'CREATE TABLE IF NOT EXISTS rsvp (id INTEGER PRIMARY KEY, name TEXT NOT NULL, game INTEGER NOT NULL, '
+        'reply TEXT NOT NULL, sub, timestamp INTEGER NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS rsvp_game_name ON rsvp (game, name, timestamp)',
+        'CREATE INDEX IF NOT EXISTS rsvp_timestamp ON rsvp (timestamp)',
+        'CREATE TABLE IF NOT EXISTS invite (id INTEGER PRIMARY KEY, game INTEGER NOT NULL, timestamp INTEGER NOT NULL)',
+    ]
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.conn = sqlite3.connect(db_file, check_same_thread=False, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        # WAL lets readers carry on while another worker writes
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            for statement in self.SCHEMA:
+                self.conn.execute(statement)
+
+    def _select(self, sql, args=()):
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(sql, args)]
+
+    def _insert(self, sql, rows):
+        with self.lock, self.conn:
+            self.conn.executemany(sql, rows)
+
+    def tables(self):
+        return [table for table in ['member', 'admin', 'rsvp']
+                if self._select('SELECT 1 FROM {} LIMIT 1'.format(table))]
+
+    def refresh(self):
+        # every query already sees other connections' commits
+        pass
+
+    def members(self):
+        return self._select('SELECT name, phone FROM member ORDER BY id')
+
+    def admins(self):
+        return self._select('SELECT name FROM admin ORDER BY id')
+
+    def latest_rsvps(self):
+        return self._select('SELECT name, game, reply, sub, timestamp FROM '
+                            '(SELECT *, ROW_NUMBER() OVER (PARTITION BY game, name ORDER BY timestamp DESC, id DESC) '
+                            'AS n FROM rsvp) WHERE n = 1 ORDER BY timestamp, id')
+
+    def rsvp_history(self, game, name=None):
+        if name is None:
+            return self._select('SELECT name, game, reply, sub, timestamp FROM rsvp WHERE game = ? '
+                                'ORDER BY timestamp, id', (game,))
+        return self._select('SELECT name, game, reply, sub, timestamp FROM rsvp WHERE game = ? AND name = ? '
+                            'ORDER BY timestamp, id', (game, name))
+
+    def rsvps_since(self, last_id):
+        # RSVPs written after row id last_id, and the newest id
+        rows = self._select('SELECT id, name, game, reply, sub, timestamp FROM rsvp WHERE id > ? ORDER BY id',
+                            (last_id,))
+        rsvps = [dict((field, r[field]) for field in RSVP_FIELDS) for r in rows]
+        return rsvps, max([r['id'] for r in rows] or [last_id])
+
+    def last_rsvp_id(self):
+        return self._select('SELECT MAX(id) AS id FROM rsvp')[0]['id'] or 0
+
+    def rsvps_before(self, game):
+        return self._select('SELECT name, game, reply, sub, timestamp FROM rsvp WHERE game < ?', (game,))
+
+    def delete_rsvps_before(self, game):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM rsvp WHERE game < ?', (game,))
+
+    def scan_rsvps(self, batch=SCAN_BATCH):
+        # every RSVP as (name, game, reply, sub, timestamp) tuples, a batch at a time. A connection of its
+        #  own reads a WAL snapshot without holding up writers for the length of the scan
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        try:
+            cursor = conn.execute('SELECT name, game, reply, sub, timestamp FROM rsvp')
+            while True:
+                rows = cursor.fetchmany(batch)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            conn.close()
+
+    def invites(self):
+        return self._select('SELECT game, timestamp FROM invite ORDER BY id')
+
+    def insert_members(self, members):
+        self._insert('INSERT INTO member (name, phone) VALUES (?, ?)', [(m['name'], m['phone']) for m in members])
+
+    def insert_admins(self, admins):
+        self._insert('INSERT INTO admin (name) VALUES (?)', [(a['name'],) for a in admins])
+
+    def insert_rsvps(self, rsvps):
+        self._insert('INSERT INTO rsvp (name, game, reply, sub, timestamp) VALUES (?, ?, ?, ?, ?)',
+                     [tuple(r[field] for field in RSVP_FIELDS) for r in rsvps])
+
+    def insert_invites(self, invites):
+        self._insert('INSERT INTO invite (game, timestamp) VALUES (?, ?)',
+                     [(i['game'], i['timestamp']) for i in invites])
+
+
+BACKENDS = {
+    'tinydb': TinyDBBackend,
+    'sqlite': SQLiteBackend,
+}
+
+
+class Store(object):
+    def __init__(self, db_file, backend=None, flush_ms=FLUSH_MS, flush_rows=FLUSH_ROWS):
+        self.db_file = db_file
+        with metrics.span('db_open'):
+            self.backend = BACKENDS[backend or DB_BACKEND](db_file)
+        # backends are not guaranteed thread safe, so serialize everything that writes
+        self.lock = threading.RLock()
+        self.shared = None  # coherence.Generation when other workers write to the same database
+        self.seen = None  # its counters as of our last look
+        self.last_rsvp_id = 0  # newest RSVP row seen, other workers' rows after it are read on the next sync
+        if coherence.SHARED:
+            # ... and every other worker as well. Their next sync has to see each reply before they
+            #  can take the lock, so there's no write-behind
+            self.lock = coherence.FileLock(db_file + '.lock')
+            self.shared = coherence.Generation(db_file + '.gen')
+            flush_ms = 0
+        self.by_phone = {}
+        self.by_name = {}
+        self.admins = None  # phone -> member, built on demand
+        self.latest = {}  # game -> {name: newest RSVP}
+        self.versions = {}  # game -> number of RSVP writes seen, for caches built on top of latest
+        self.spots = {}  # game -> players in, members plus subs
+        self.attendance = {}  # name -> games with a 'yes' as the final reply
+        self.generation = 0  # bumped on every (re)load
+        self.views = {}  # caches other modules build on top of this store, dropped with it
+        self.archive = archive.Archive(archive.archive_dir(db_file))  # seasons moved out of the backend
+        self.marker = coherence.hold_open(db_file)  # tells archive.py and import.py the database is in use
+        self.flush_ms = flush_ms
+        self.flush_rows = flush_rows
+        self.pending = []  # RSVPs indexed but not yet written
+        self.flush_timer = None
+        if self.flush_ms:
+            atexit.register(self.flush)
+        self.load()
+        if self.shared is not None:
+            self.lock.on_acquire = self._sync
+
+    def load(self):
+        # (re)build the phone -> member and name -> member indexes
+        with self.lock, metrics.span('db_load'):
+            self.by_phone = {}
+            self.by_name = {}
+            for member in self.backend.members():
+                self._index_member(member)
+            self.invalidate_admins()
+            # the current reply of every member, per game
+            self.latest = {}
+            self.versions = {}
+            self.spots = {}
+            self.attendance = {}
+            self.generation += 1
+            for rsvp in self.backend.latest_rsvps():
+                self._index_rsvp(rsvp)
+            # archived seasons still count towards attendance (STANDBY priority)
+            for name, games in self.archive.attendance().items():
+                self.attendance[name] = self.attendance.get(name, 0) + games
+            if self.shared is not None:
+                self.seen = self.shared.read()
+                self.last_rsvp_id = self.backend.last_rsvp_id()
+
+    def refresh(self):
+        # catch up with other workers' writes. Without any, this is one read of the shared counters
+        if self.shared is not None and self.shared.read() != self.seen:
+            with self.lock:
+                self._sync()
+
+    def _sync(self):
+        # runs whenever the file lock is taken: brings the indexes up to date with the database
+        counters = self.shared.read()
+        if counters == self.seen:
+            return
+        with metrics.span('db_sync'):
+            self.backend.refresh()
+            if counters[1] != self.seen[1]:
+                # members, admins or archived seasons changed
+                self.archive = archive.Archive(self.archive.directory)
+                self.load()
+            else:
+                rsvps, self.last_rsvp_id = self.backend.rsvps_since(self.last_rsvp_id)
+                for rsvp in rsvps:
+                    self._index_rsvp(rsvp)
+                    self.versions[rsvp['game']] = self.versions.get(rsvp['game'], 0) + 1
+                self.seen = counters
+            # STANDBY lists and the like are rebuilt from the new replies when next needed
+            self.views.clear()
+
+    def _publish(self, reload=False):
+        # after a write, under the lock: let the other workers know
+        if self.shared is not None:
+            self.seen = self.shared.bump(reload)
+            self.last_rsvp_id = self.backend.last_rsvp_id()
+
+    def _index_member(self, member):
+        self.by_phone[member['phone']] = member
+        self.by_name[member['name']] = member
+
+    def tables(self):
+        return self.backend.tables()
+
+    # Members
+    def get_member(self, phone):
+        return self.by_phone.get(phone)
+
+    def get_member_by_name(self, name):
+        return self.by_name.get(name)
+
+    def get_members(self):
+        return list(self.by_phone.values())
+
+    def add_members(self, members):
+        with self.lock, metrics.span('db_insert', table='Member'):
+            self.backend.insert_members(members)
+            self._publish(reload=True)
+            for member in members:
+                self._index_member(member)
+            self.invalidate_admins()
+
+    # Admins
+    def invalidate_admins(self):
+        # call whenever the Member or Admin table changes
+        self.admins = None
+
+    def _get_admins(self):
+        admins = self.admins
+        if admins is None:
+            with self.lock:
+                names = set(_['name'] for _ in self.backend.admins())
+                admins = dict((phone, member) for phone, member in self.by_phone.items() if member['name'] in names)
+                self.admins = admins
+        return admins
+
+    def is_admin(self, phone):
+        return phone in self._get_admins()
+
+    def get_admins(self):
+        return list(self._get_admins().values())
+
+    def add_admins(self, admins):
+        with self.lock, metrics.span('db_insert', table='Admin'):
+            self.backend.insert_admins(admins)
+            self._publish(reload=True)
+            self.invalidate_admins()
+
+    # RSVPs
+    def _index_rsvp(self, rsvp):
+        replies = self.latest.setdefault(rsvp['game'], {})
+        current = replies.get(rsvp['name'])
+        if current is None or rsvp['timestamp'] >= current['timestamp']:
+            replies[rsvp['name']] = rsvp
+            # keep the per-game head count and per-member attendance in step with the newest reply
+            self.spots[rsvp['game']] = self.spots.get(rsvp['game'], 0) - players(current) + players(rsvp)
+            attended = (rsvp['reply'] == 'yes') - (current is not None and current['reply'] == 'yes')
+            if attended:
+                self.attendance[rsvp['name']] = self.attendance.get(rsvp['name'], 0) + attended
+
+    def game_version(self, game):
+        # changes whenever the replies for a game might have
+        return self.generation, self.versions.get(game, 0)
+
+    def get_rsvp(self, game, name):
+        # newest RSVP from a member for a game (game timestamp), or None
+        return self.latest.get(game, {}).get(name)
+
+    def get_spots(self, game):
+        return self.spots.get(game, 0)
+
+    def get_attendance(self, name):
+        return self.attendance.get(name, 0)
+
+    def get_game_rsvps(self, game):
+        # {name: newest RSVP} for everyone who replied for a game, archived games included
+        if game not in self.latest and self.archive.has_game(game):
+            return self.archive.game_rsvps(game)
+        return dict(self.latest.get(game, {}))
+
+    def get_rsvp_history(self, game, name=None):
+        # every reply for a game (optionally one member's), oldest first, for auditing.
+        #  Archived games only have each member's final reply
+        with self.lock:
+            self.flush()
+            with metrics.span('db_search', table='RSVP'):
+                rsvps = self.backend.rsvp_history(game, name)
+        if self.archive.has_game(game):
+            rsvps = sorted(self.archive.history(game, name) + rsvps, key=lambda r: r['timestamp'])
+        return rsvps
+
+    def scan_rsvps(self):
+        # the whole RSVP history in batches of tuples, archived seasons included, for analytics
+        self.flush()
+        for batch in self.backend.scan_rsvps():
+            yield batch
+        for batch in self.archive.scan():
+            yield batch
+
+    def archive_before(self, game):
+        # move the RSVPs of every game before `game` into the archive; returns how many were moved
+        with self.lock:
+            self.flush()
+            rsvps = [dict(r) for r in self.backend.rsvps_before(game)]
+            if not rsvps:
+                return 0
+            # archived first: a crash before the delete leaves duplicates the next run merges away
+            self.archive.add(rsvps)
+            with metrics.span('db_delete', table='RSVP'):
+                self.backend.delete_rsvps_before(game)
+            self._publish(reload=True)
+            self.load()
+            return len(rsvps)
+
+    def insert_rsvp(self, rsvp):
+        self.insert_rsvps([rsvp])
+
+    def insert_rsvps(self, rsvps):
+        with self.lock:
+            if not self.flush_ms:
+                with metrics.span('db_insert', table='RSVP'):
+                    self.backend.insert_rsvps(rsvps)
+                self._publish()
+            else:
+                # readers see the reply through the index straight away, the write follows in a batch
+                self.pending.extend(rsvps)
+                if len(self.pending) >= self.flush_rows:
+                    self.flush()
+                elif self.flush_timer is None:
+                    self.flush_timer = threading.Timer(self.flush_ms / 1000.0, self.flush)
+                    self.flush_timer.daemon = True
+                    self.flush_timer.start()
+            for rsvp in rsvps:
+                self._index_rsvp(rsvp)
+                self.versions[rsvp['game']] = self.versions.get(rsvp['game'], 0) + 1
+
+    def flush(self):
+        # write any buffered RSVPs in one batch
+        with self.lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+            if not self.pending:
+                return 0
+            batch, self.pending = self.pending, []
+            try:
+                with metrics.span('db_insert', table='RSVP'):
+                    self.backend.insert_rsvps(batch)
+            except Exception:
+                # keep them for the next flush rather than lose replies
+                self.pending = batch + self.pending
+                raise
+            self._publish()
+            return len(batch)
+
+    # Invites: when each poll went out
+    def log_invite(self, game, timestamp):
+        with self.lock, metrics.span('db_insert', table='Invite'):
+            self.backend.insert_invites([{'game': game, 'timestamp': timestamp}])
+            self._publish()
+
+    def get_invites(self):
+        with self.lock:
+            return self.backend.invites()
+
+    def close(self):
+        self.flush()
+        if self.flush_ms:
+            atexit.unregister(self.flush)
+        if self.shared is not None:
+            self.lock.close()
+            self.shared.close()
+        if self.marker is not None:
+            self.marker.close()
+            self.marker = None
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    # One Store per process, reopened only if the configured db file changes. While a request for one
+    #  of config.groups is handled, that group's store instead. Either is brought up to date with
+    #  other workers' writes first (config.db_shared)
+    group = groups.current()
+    if group is not None:
+        group.store.refresh()
+        return group.store
+    global _store
+    with _store_lock:
+        if _store is None or _store.db_file != config.db_file:
+            if _store is not None:
+                _store.close()
+            _store = Store(config.db_file)
+    _store.refresh()
+    return _store
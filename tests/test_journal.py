@@ -0,0 +1,52 @@
+import csv
+
+import journal
+
+
+def csv_phones(path):
+    with open(path, newline='') as f:
+        return sorted(row['phone_number'] for row in csv.DictReader(f))
+
+
+def test_journals_catch_up(tmp_path):
+    path = str(tmp_path / '2030-01-02.csv')
+    a = journal.Journal(path)
+    b = journal.Journal(path)
+    a.append('+1', 'A', 'y')
+    assert b.append('+2', 'B', 'y') is None
+    assert sorted(a.get_rows()) == ['+1', '+2']
+    # b's reply to a's line is a change
+    assert b.append('+1', 'A', 'n') == {'name': 'A', 'rsvp': 'y'}
+    a.close()
+    b.close()
+    assert journal.read_rows(path)['+1']['rsvp'] == 'n'
+
+
+def test_compaction_keeps_other_journals_lines(tmp_path):
+    path = str(tmp_path / '2030-01-02.csv')
+    a = journal.Journal(path)
+    b = journal.Journal(path)
+    a.append('+1', 'A', 'y')
+    b.append('+2', 'B', 'y')
+    a.compact()
+    assert csv_phones(path) == ['+1', '+2']
+    # b notices the compaction and reads the new CSV before its next line
+    b.append('+3', 'C', 'n')
+    assert sorted(b.get_rows()) == ['+1', '+2', '+3']
+    b.compact()
+    a.close()
+    b.close()
+    assert csv_phones(path) == ['+1', '+2', '+3']
+
+
+def test_torn_line_is_skipped(tmp_path):
+    path = str(tmp_path / '2030-01-02.csv')
+    a = journal.Journal(path)
+    a.append('+1', 'A', 'y')
+    a.close()
+    with open(journal.journal_path(path), 'ab') as f:
+        f.write(b'+2,B')
+    b = journal.Journal(path)
+    b.append('+3', 'C', 'y')
+    b.close()
+    assert sorted(journal.Journal(path).get_rows()) == ['+1', '+3']
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+import coherence
+import store
+
+GAME = 1893456000
+WORKERS = 4
+REPLIES = 50
+
+
+def rsvp(name, timestamp=1):
+    return {'name': name, 'game': GAME, 'reply': 'yes', 'sub': None, 'timestamp': timestamp}
+
+
+@pytest.fixture
+def db_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(coherence, 'SHARED', True)
+    return str(tmp_path / 'shared.db')
+
+
+def test_stores_catch_up(db_file):
+    a = store.Store(db_file, 'tinydb')
+    b = store.Store(db_file, 'tinydb')
+    a.insert_rsvp(rsvp('A'))
+    b.refresh()
+    assert b.get_rsvp(GAME, 'A') is not None
+    # b's write lands after a's, with its own doc id, and a picks it up incrementally
+    b.insert_rsvp(rsvp('B'))
+    a.refresh()
+    assert sorted(a.get_game_rsvps(GAME)) == ['A', 'B']
+    # a member added in one store means a full reload in the other
+    b.add_members([{'name': 'C', 'phone': '+15555550003'}])
+    a.refresh()
+    assert a.get_member('+15555550003')['name'] == 'C'
+    a.close()
+    b.close()
+    assert len(list(store.TinyDBBackend(db_file).latest_rsvps())) == 2
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_forked_workers_keep_every_reply(db_file):
+    # opened before forking, as with gunicorn --preload
+    db = store.Store(db_file, 'tinydb')
+    pids = []
+    for worker in range(WORKERS):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                for n in range(REPLIES):
+                    db.refresh()
+                    db.insert_rsvp(rsvp('w{}-{}'.format(worker, n)))
+                code = 0
+            finally:
+                os._exit(code)
+        pids.append(pid)
+    for pid in pids:
+        assert os.waitpid(pid, 0)[1] == 0
+    db.refresh()
+    assert len(db.get_game_rsvps(GAME)) == WORKERS * REPLIES
+    db.close()
+    fresh = store.Store(db_file, 'tinydb')
+    assert len(fresh.get_game_rsvps(GAME)) == WORKERS * REPLIES
+    fresh.close()
@@ -0,0 +1,47 @@
+import arrow
+import pytest
+
+import app
+import config
+import standby
+import store
+
+GAME = arrow.get('2030-01-02 19:00', 'YYYY-MM-DD HH:mm')
+
+
+@pytest.fixture
+def sent(tmp_path, monkeypatch):
+    # a fresh store with a two player game; texts and admin notifications are recorded, not sent
+    monkeypatch.setattr(config, 'db_file', str(tmp_path / 'test.db'), raising=False)
+    monkeypatch.setattr(standby, 'CAPACITY', 2)
+    messages = []
+    monkeypatch.setattr(app, 'send_messages', lambda jobs: messages.extend(jobs))
+    monkeypatch.setattr(app, 'notify_admin', lambda message, *args, **kwargs: messages.append(('admins', message)))
+    store.get_store().add_members([{'name': name, 'phone': '+1555555000{}'.format(i)} for i, name in enumerate('ABC')])
+    yield messages
+    store.get_store().close()
+
+
+def rsvp(name, reply, sub=None):
+    return app.set_rsvp(GAME, store.get_store().get_member_by_name(name), reply, sub)
+
+
+def test_standby_promoted_once(sent):
+    rsvp('A', 'yes', '1')
+    assert rsvp('C', 'yes') == 'standby'
+    rsvp('A', 'no')
+    invites = [member for member, message in sent if member != 'admins']
+    assert [member['name'] for member in invites] == ['C']
+    assert ('admins', 'Moved up from STANDBY: C') in sent
+    history = store.get_store().get_rsvp_history(GAME.timestamp, 'C')
+    assert [r['reply'] for r in history] == ['standby', 'yes']
+
+
+def test_more_subs_than_fit_keeps_spot(sent):
+    rsvp('A', 'yes')
+    rsvp('B', 'yes')
+    assert rsvp('A', 'yes', '2') == 'full'
+    db = store.get_store()
+    assert db.get_rsvp(GAME.timestamp, 'A')['reply'] == 'yes'
+    assert db.get_rsvp(GAME.timestamp, 'A')['sub'] is None
+    assert db.get_spots(GAME.timestamp) == 2